@@ -7,15 +7,16 @@ from direct.showbase.ShowBaseGlobal import globalClock
 from direct.showbase.InputStateGlobal import inputState
 from panda3d.bullet import BulletWorld, BulletDebugNode
 from panda3d.core import NodePath, TextNode
-from panda3d.core import Point2, Point3, Quat, Vec3, LColor, CardMaker
+from panda3d.core import Point2, Vec3, LColor, CardMaker
 from panda3d.core import TransparencyAttrib
 from panda3d.core import load_prc_file_data
 from direct.interval.IntervalGlobal import Sequence, Func
 
-from constants import Mask
 from walker import Walker, Motions
 from scene import Scene
 from ball_controller import BallController
+from camera_solver import CameraSolver
+from simulation_clock import SimulationClock
 from utils import DrawText
 
 
@@ -45,12 +46,13 @@ class AvoidBalls(ShowBase):
         self.world.set_gravity(0, 0, -9.81)
 
         self.debug_np = self.render.attach_new_node(BulletDebugNode('debug'))
+        self.debug_np.set_shader_off()
         self.world.set_debug_node(self.debug_np.node())
 
         self.scene = Scene(self.world)
         self.scene.reparent_to(self.render)
 
-        self.walker = Walker(self.world)
+        self.walker = Walker(self.world, self.scene.terrains.sampler)
         self.walker.reparent_to(self.render)
 
         self.floater = NodePath('floater')
@@ -61,15 +63,22 @@ class AvoidBalls(ShowBase):
         self.camera.set_pos(self.walker.navigate())
         self.camera.look_at(self.floater)
         self.camLens.set_fov(90)
+        self.camera_solver = CameraSolver(
+            self.world, self.walker, self.camera, self.floater, pyramid=self.scene.terrains.pyramid)
 
         self.socre_display = ScoreDisplays()
         self.screen = Screen()
         self.screen.show_start_screen()
 
-        self.ball_controller = BallController(self.world, self.walker, self.socre_display)
+        self.ball_controller = BallController(
+            self.world, self.walker, self.socre_display, self.scene.terrains.sampler, self.scene.terrains.placer)
         self.timer = 0
         self.state = None
 
+        self.clock = SimulationClock()
+        self.clock.add(self.walker)
+        self.clock.add(self.ball_controller.trajectories)
+
         inputState.watch_with_modifiers('forward', 'arrow_up')
         inputState.watch_with_modifiers('backward', 'arrow_down')
         inputState.watch_with_modifiers('left', 'arrow_left')
@@ -89,43 +98,11 @@ class AvoidBalls(ShowBase):
         else:
             self.debug_np.hide()
 
-    def ray_cast(self, from_pos, to_pos):
-        if (result := self.world.ray_test_closest(
-                from_pos, to_pos, Mask.environment)).has_hit():
-            return result.get_node()
-
-        return None
-
-    def find_camera_pos(self, walker_pos, next_pos):
-        q = Quat()
-        point = Point3(0, 0, 0)
-        start = self.camera.get_pos()
-        angle = r = None
-
-        for i in range(36):
-            camera_pos = next_pos + walker_pos
-            if self.ray_cast(camera_pos, walker_pos) == self.walker.node():
-                return next_pos
-
-            times = i // 2 + 1
-            angle = 10 * times if i % 2 == 0 else -10 * times
-            q.set_from_axis_angle(angle, Vec3.up())
-            r = q.xform(start - point)
-            next_pos = point + r
-
-        return None
-
     def control_camera(self):
         """Reposition the camera if the camera's view is blocked
            by other objects like terrain, rocks, trees.
         """
-        walker_pos = self.walker.get_pos()
-        camera_pos = self.camera.get_pos() + walker_pos
-
-        if self.ray_cast(camera_pos, walker_pos) != self.walker.node():
-            if next_pos := self.find_camera_pos(walker_pos, self.walker.navigate()):
-                self.camera.set_pos(next_pos)
-                self.camera.look_at(self.floater)
+        self.camera_solver.update()
 
     def control_walker(self, dt):
         motions = []
@@ -142,20 +119,27 @@ class AvoidBalls(ShowBase):
         self.walker.update(dt, motions)
 
     def find_walker_start_pos(self):
-        for hit in self.world.rayTestAll(
-                Point3(0, 0, 30), Point3(0, 0, -30), mask=Mask.terrain).get_hits():
+        pos = self.scene.terrains.sampler.get_pos(0, 0)
+        return pos + Vec3(0, 0, 1.5)
+
+    def simulate(self, dt):
+        """Step the walker, the balls and the Bullet world by the fixed step of the clock,
+           and put rendered transforms between the last two states.
+        """
+        step = self.clock.step
 
-            if hit.get_node() == self.walker.node():
-                continue
+        for _ in range(self.clock.tick(dt)):
+            self.control_walker(step)
+            self.ball_controller.update(step)
+            self.world.do_physics(step, 1, step)
 
-            pos = hit.get_hit_pos()
-            return pos + Vec3(0, 0, 1.5)
+        self.clock.interpolate()
 
     def update(self, task):
-        dt = globalClock.get_dt()
-        self.control_walker(dt)
+        self.simulate(globalClock.get_dt())
         self.control_camera()
-        self.ball_controller.update(dt)
+        self.scene.terrains.natures.update_lod()
+        self.scene.directional_light.update(self.walker.get_pos())
 
         match self.state:
 
@@ -170,11 +154,12 @@ class AvoidBalls(ShowBase):
 
             case Status.READY:
                 if not self.screen.is_appear:
+                    self.scene.terrains.heightmap.prefetch()
                     self.state = Status.PLAY
 
             case Status.SETUP:
                 pos = self.find_walker_start_pos()
-                self.walker.set_pos(pos)
+                self.walker.place(pos)
                 self.scene.setup_scene()
                 self.screen.hide_screen()
                 self.state = Status.READY
@@ -187,7 +172,6 @@ class AvoidBalls(ShowBase):
                 if self.screen.is_appear:
                     self.state = Status.MAKE
 
-        self.world.do_physics(dt)
         return task.cont
 
 
@@ -1,12 +1,13 @@
 import math
 import random
 from collections import deque
-from enum import Enum
+from enum import Enum, auto
 
 import numpy as np
-from direct.interval.IntervalGlobal import ProjectileInterval, Parallel, Sequence, Func
-from panda3d.core import NodePath, TransformState
-from panda3d.core import LColor, Point3, Vec3, Point2
+from direct.interval.IntervalGlobal import ProjectileInterval
+from panda3d.core import NodePath, PandaNode, TransformState
+from panda3d.core import LColor, Point3, Point2
+from panda3d.core import Shader, Texture, SamplerState, BoundingBox
 from panda3d.bullet import BulletRigidBodyNode, BulletSphereShape
 
 from constants import Config, Mask
@@ -27,38 +28,126 @@ class Colors(Enum):
         return choice.value
 
 
-class SplashSequence(Sequence):
+class Splashes(NodePath):
+    """Keep all the live splash particles in arrays, and draw them as one instanced sphere.
+       Each particle flies on a parabola to a random point and shrinks, like ProjectileInterval
+       and scaleInterval did, but all of them are moved by one vectorized update.
+        Args:
+            sphere (NodePath): the model of particles;
+            capacity (int): the initial size of the arrays, which are doubled when full;
+            particles (int): the number of particles per splash;
+            duration (float): the life time of particles;
+    """
+
+    def __init__(self, sphere, capacity=256, particles=10, duration=0.5):
+        super().__init__(PandaNode('splashes'))
+        self.particles = particles
+        self.duration = duration
+        self.gravity = -ProjectileInterval.gravity
+        self.radius = sphere.radius
+        self.count = 0
+
+        self.start = np.zeros((capacity, 3), dtype=np.float32)
+        self.velocity = np.zeros((capacity, 3), dtype=np.float32)
+        self.start_scale = np.zeros(capacity, dtype=np.float32)
+        self.color = np.zeros((capacity, 4), dtype=np.float32)
+        self.age = np.zeros(capacity, dtype=np.float32)
+        # (x, y, z, scale) and (r, g, b, a) for each particle.
+        self.data = np.zeros((capacity, 2, 4), dtype=np.float32)
+
+        self.model = sphere.copy_to(self)
+        self.tex = Texture('instance_data')
+        self.tex.set_minfilter(SamplerState.FT_nearest)
+        self.tex.set_magfilter(SamplerState.FT_nearest)
+        shader = Shader.load(Shader.SL_GLSL, 'shaders/splash_v.glsl', 'shaders/nature_f.glsl')
+        self.model.set_shader(shader)
+        self.model.set_shader_input('instance_data', self.tex)
+        self.model.stash()
+
+    def grow(self):
+        capacity = len(self.age) * 2
+        n = self.count
+
+        for name in ('start', 'velocity', 'start_scale', 'color', 'age', 'data'):
+            arr = getattr(self, name)
+            new = np.zeros((capacity, *arr.shape[1:]), dtype=np.float32)
+            new[:n] = arr[:n]
+            setattr(self, name, new)
+
+    def add(self, pos, color):
+        """Write the particles of a splash into the arrays.
+            Args:
+                pos (Point3): the point where a ball landed;
+                color (LColor): the color of the ball;
+        """
+        while self.count + self.particles > len(self.age):
+            self.grow()
+
+        block = slice(self.count, self.count + self.particles)
+        diff = np.random.uniform((-2, -2, 1.5), (2, 2, 4), (self.particles, 3))
+        # The velocity to reach pos + diff at the end of the duration.
+        diff[:, 2] -= 0.5 * self.gravity * self.duration ** 2
+
+        self.start[block] = pos
+        self.velocity[block] = diff / self.duration
+        self.start_scale[block] = np.random.uniform(0.2, 0.4, self.particles)
+        # The alpha of some colors is 0, but balls are opaque.
+        self.color[block] = (color.x, color.y, color.z, 1)
+        self.age[block] = 0
+        self.count += self.particles
+
+    def update(self, dt):
+        if self.count == 0:
+            return
+
+        n = self.count
+        self.age[:n] += dt
+
+        # Particles are in the order of splashes, so the dead ones are at the front.
+        if (dead := int(np.searchsorted(-self.age[:n], -self.duration, side='right'))):
+            for arr in (self.start, self.velocity, self.start_scale, self.color, self.age):
+                arr[:n - dead] = arr[dead:n]
+            n = self.count = n - dead
 
-    def __init__(self, np, model, color, pos):
-        super().__init__()
-        self.append(Parallel(*[para for para in self.make_splash(np, model, color, pos)]))
-        self.append(Func(lambda: np.remove_node()))
+        if n == 0:
+            self.model.stash()
+            return
 
-    def make_splash(self, np, model, color, pos):
-        for _ in range(10):
-            ball = model.copy_to(np)
-            ball.set_color(color)
-            start_scale = random.uniform(0.2, 0.4)
-            diff = Vec3(random.uniform(-2, 2), random.uniform(-2, 2), random.uniform(1.5, 4))
+        t = self.age[:n, None]
+        data = self.data[:n]
+        data[:, 0, :3] = self.start[:n] + self.velocity[:n] * t
+        data[:, 0, 2] += 0.5 * self.gravity * t[:, 0] ** 2
+        data[:, 0, 3] = self.start_scale[:n] + (0.01 - self.start_scale[:n]) * t[:, 0] / self.duration
+        data[:, 1] = self.color[:n]
 
-            para = Parallel(
-                ProjectileInterval(ball, duration=0.5, startPos=pos, endPos=pos + diff, gravityMult=1.0),
-                ball.scaleInterval(0.5, Vec3(0.01), Vec3(start_scale))
-            )
+        self.model.unstash()
+        self.tex.setup_2d_texture(2, n, Texture.T_float, Texture.F_rgba32)
+        # The components of a ram image are in BGRA order.
+        self.tex.set_ram_image(np.ascontiguousarray(data[..., [2, 1, 0, 3]]))
+        self.model.set_instance_count(n)
 
-            yield para
+        # The vertices are moved in the shader, so the bounds cannot be computed by Panda3D.
+        reach = self.radius * data[:, 0, 3].max()
+        lower = data[:, 0, :3].min(axis=0) - reach
+        upper = data[:, 0, :3].max(axis=0) + reach
+        self.model.node().set_bounds(BoundingBox(Point3(*lower), Point3(*upper)))
+
+
+class Exhaustion(Enum):
+    """What BallPool does when all of its balls are in use."""
+
+    GROW = auto()
+    DROP = auto()
+    RECYCLE = auto()
 
 
 class Ball(NodePath):
 
-    def __init__(self, sphere, color, start_pt, end_pt, scale=0.5):
+    def __init__(self, sphere, scale=0.5):
         super().__init__(BulletRigidBodyNode('ball'))
         self.ball = sphere.copy_to(self)
         self.ball.reparent_to(self)
-
         self.set_scale(scale)
-        self.set_color(color)
-        self.set_pos(start_pt)
 
         self.set_collide_mask(Mask.ball)
         self.node().set_kinematic(True)
@@ -67,49 +156,235 @@ class Ball(NodePath):
         size = tip - end
         self.node().add_shape(BulletSphereShape(size.z / 2))
 
+    def setup_ball(self, color, start_pt, end_pt):
+        self.set_color(color)
+        self.set_pos(start_pt)
+
         mid_pt = (start_pt + end_pt) / 2
         mid_pt.z += 20
         self.passing_pts = (start_pt, mid_pt, end_pt)
-        self.total_dt = 0
-
-    def bernstein(self, n, k):
-        coef = math.factorial(n) / (math.factorial(k) * math.factorial(n - k))
-        return coef * self.total_dt ** k * (1 - self.total_dt) ** (n - k)
-
-    def bezier_curve(self, dt):
-        self.total_dt += dt
 
-        if self.total_dt > 1:
-            self.total_dt = 1
 
-        n = len(self.passing_pts) - 1
-        px = py = pz = 0
-
-        for i, pt in enumerate(self.passing_pts):
-            b = self.bernstein(n, i)
-            px += np.dot(b, pt[0])
-            py += np.dot(b, pt[1])
-            pz += np.dot(b, pt[2])
-
-        return Point3(px, py, pz)
-
-    def splash(self):
-        np = NodePath('splash')
-        np.reparent_to(self.get_parent())  # parent is balls.
-        return SplashSequence(np, self.ball, self.get_color(), self.get_pos())
+class Trajectories:
+    """Quadratic Bezier curves of the moving balls, kept in arrays and advanced all together.
+       The balls are packed at the front of the arrays; a finished ball is replaced by the last one.
+        Args:
+            capacity (int): the initial size of the arrays, which are doubled when full.
+    """
+
+    def __init__(self, capacity=32):
+        self.balls = []
+        # The TransformStates made for sweeps at pos and last_pos, or None.
+        self.states = []
+        self.last_states = []
+        self.points = np.zeros((capacity, 3, 3))
+        self.progress = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.pos = np.zeros((capacity, 3))
+        self.last_pos = np.zeros((capacity, 3))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def grow(self):
+        capacity = len(self.progress) * 2
+        n = self.count
+
+        for name in ('points', 'progress', 'speed', 'pos', 'last_pos'):
+            arr = getattr(self, name)
+            new = np.zeros((capacity, *arr.shape[1:]))
+            new[:n] = arr[:n]
+            setattr(self, name, new)
+
+    def add(self, ball, passing_pts, speed=1):
+        """Args:
+            ball (Ball): the ball to be moved;
+            passing_pts (tuple): the start, control and end points of the curve;
+            speed (float): the ratio of the curve which the ball goes along per second;
+        """
+        if self.count == len(self.progress):
+            self.grow()
+
+        i = self.count
+        self.points[i] = passing_pts
+        self.progress[i] = 0
+        self.speed[i] = speed
+        self.pos[i] = passing_pts[0]
+        self.last_pos[i] = passing_pts[0]
+        self.balls.append(ball)
+        self.states.append(None)
+        self.last_states.append(None)
+        self.count += 1
+
+    def remove(self, i):
+        """Remove the ball at index i, moving the last ball into its place."""
+        last = self.count - 1
+        ball = self.balls[i]
+
+        if i != last:
+            self.balls[i] = self.balls[last]
+            self.states[i] = self.states[last]
+            self.last_states[i] = self.last_states[last]
+            self.points[i] = self.points[last]
+            self.progress[i] = self.progress[last]
+            self.speed[i] = self.speed[last]
+            self.pos[i] = self.pos[last]
+            self.last_pos[i] = self.last_pos[last]
+
+        self.balls.pop()
+        self.states.pop()
+        self.last_states.pop()
+        self.count = last
+        return ball
+
+    def get_oldest(self):
+        """Return the index of the ball which will land first."""
+        n = self.count
+        return int(np.argmin((1 - self.progress[:n]) / self.speed[:n]))
+
+    def advance(self, dt):
+        """Move all the balls along their curves and return the positions
+           before and after the move as arrays of shape (n, 3).
+        """
+        n = self.count
+        t = np.minimum(self.progress[:n] + self.speed[:n] * dt, 1)
+        self.progress[:n] = t
+
+        u = 1 - t
+        p = self.points[:n]
+        self.last_pos[:n] = self.pos[:n]
+        self.last_states, self.states = self.states, [None] * n
+        self.pos[:n] = (u * u)[:, None] * p[:, 0] + (2 * u * t)[:, None] * p[:, 1] + (t * t)[:, None] * p[:, 2]
+        self.set_positions(self.pos[:n])
+
+        return self.last_pos[:n], self.pos[:n]
+
+    def set_positions(self, pos):
+        # Panda3D has no call to move many nodes at once, and the balls are kinematic
+        # bodies which Bullet reads from their nodes at every step, for the banner to collide with.
+        for ball, (x, y, z) in zip(self.balls, pos.tolist()):
+            ball.set_pos(x, y, z)
+
+    def restore(self):
+        self.set_positions(self.pos[:self.count])
+
+    def interpolate(self, alpha):
+        """Put the balls between the positions before and after the last move."""
+        n = self.count
+        self.set_positions(self.last_pos[:n] + (self.pos[:n] - self.last_pos[:n]) * alpha)
+
+
+class BallPool:
+    """Keep pre-built balls which are not in the scene graph nor in the Bullet world,
+       so that a shot only resets the color, position and trajectory of a ball.
+        Args:
+            sphere (NodePath): the model of balls;
+            trajectories (Trajectories): the trajectories of the balls in flight;
+            capacity (int): the number of balls built at first;
+            policy (Exhaustion): GROW builds a new ball, DROP gives up the shot,
+                                 and RECYCLE takes the ball in flight the longest;
+    """
+
+    def __init__(self, sphere, trajectories, capacity=32, policy=Exhaustion.GROW):
+        self.sphere = sphere
+        self.trajectories = trajectories
+        self.capacity = capacity
+        self.policy = policy
+        self.free = [Ball(self.sphere) for _ in range(capacity)]
+        self.in_use = 0
+        self.high_water = 0
+
+        self.reused = 0
+        self.misses = 0
+        self.grown = 0
+        self.dropped = 0
+        self.recycled = 0
+
+    @property
+    def stats(self):
+        return dict(
+            capacity=self.capacity,
+            in_use=self.in_use,
+            occupancy=self.in_use / self.capacity,
+            high_water=self.high_water,
+            reused=self.reused,
+            misses=self.misses,
+            grown=self.grown,
+            dropped=self.dropped,
+            recycled=self.recycled
+        )
+
+    def get(self):
+        """Return a free ball, or handle the exhaustion of the pool by the policy.
+           A recycled ball is still attached to the scene graph and the Bullet world.
+           Returns None if the shot is dropped.
+        """
+        if self.free:
+            self.reused += 1
+            ball = self.free.pop()
+        else:
+            self.misses += 1
+
+            match self.policy:
+                case Exhaustion.GROW:
+                    self.grown += 1
+                    self.capacity += 1
+                    ball = Ball(self.sphere)
+
+                case Exhaustion.RECYCLE if self.trajectories:
+                    self.recycled += 1
+                    return self.trajectories.remove(self.trajectories.get_oldest())
+
+                case _:
+                    self.dropped += 1
+                    return None
+
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return ball
+
+    def put(self, ball):
+        """Args:
+            ball (Ball): the ball removed from the scene graph and the Bullet world.
+        """
+        self.in_use -= 1
+        self.free.append(ball)
 
 
 class BallController:
-
-    def __init__(self, world, walker, score_display):
+    """Args:
+        world (BulletWorld): the world where balls are attached;
+        walker (Walker): the character balls are thrown at;
+        score_display (ScoreDisplays): the display of scores;
+        sampler (HeightSampler): the sampler of the terrain surface;
+        placer (NaturePlacer): the placer holding the footprints of natures and the goal gate;
+    """
+
+    def __init__(self, world, walker, score_display, sampler, placer):
         self.world = world
         self.walker = walker
         self.score_display = score_display
+        self.sampler = sampler
+        self.placer = placer
         self.ball = Sphere()
-        self.moving_q = deque()
+        self.sweep_shape = BulletSphereShape(0.5)
+        self.sweeps = 0
+        self.rejected = 0
+        self.trajectories = Trajectories()
+        self.pool = BallPool(self.ball, self.trajectories)
         self.remove_q = deque()
         self.balls = NodePath('balls')
         self.balls.reparent_to(base.render)
+        self.splashes = Splashes(self.ball)
+        self.splashes.reparent_to(self.balls)
+
+    @property
+    def collision_stats(self):
+        return dict(
+            sweeps=self.sweeps,
+            rejected=self.rejected
+        )
 
     def get_shoot_pos(self, pos):
         """Returns the point where ball is thrown.
@@ -127,9 +402,8 @@ class BallController:
         pt2 = Point2(x, y) + pos.xy
         z = 30
 
-        if (result := self.world.ray_test_closest(
-                Point3(pt2, 30), Point3(pt2, -30), mask=Mask.terrain)).has_hit():
-            z = result.get_hit_pos().z + 35
+        if (height := self.sampler.get_height(pt2.x, pt2.y)) is not None:
+            z = height + 35
 
         return Point3(pt2, z)
 
@@ -153,39 +427,92 @@ class BallController:
         if contact_pos := self.walker.get_terrain_contact_pos():
             if shoot_pos := self.get_shoot_pos(contact_pos):
                 dest = self.get_dest_pos(contact_pos)
-                color = Colors.choice()
-                ball = Ball(self.ball, color, shoot_pos, dest)
-                ball.reparent_to(self.balls)
-                self.world.attach(ball.node())
-                self.moving_q.append(ball)
+                if (ball := self.pool.get()) is None:
+                    return
+
+                if not ball.has_parent():
+                    ball.reparent_to(self.balls)
+                    self.world.attach(ball.node())
+
+                ball.setup_ball(Colors.choice(), shoot_pos, dest)
+                self.trajectories.add(ball, ball.passing_pts)
 
     def update(self, dt):
         for _ in range(len(self.remove_q)):
             ball = self.remove_q.popleft()
-            splash = ball.splash()
+            self.splashes.add(ball.get_pos(), ball.get_color())
             self.world.remove(ball.node())
-            ball.remove_node()
-            splash.start()
+            ball.detach_node()
+            self.pool.put(ball)
 
-        for _ in range(len(self.moving_q)):
-            ball = self.moving_q.popleft()
-            current_pos = ball.get_pos()
-            next_pt = ball.bezier_curve(dt)
-            ball.set_pos(next_pt)
+        self.splashes.update(dt)
 
-            if self.will_collide(current_pos, next_pt) or ball.total_dt == 1:
-                self.remove_q.append(ball)
-                continue
+        if not self.trajectories:
+            return
+
+        last_pos, pos = self.trajectories.advance(dt)
+        finished = self.trajectories.progress[:len(self.trajectories)] == 1
+        removed = self.find_collisions(last_pos, pos) | finished
+
+        # Remove from the back so that the indices of the others do not change.
+        for i in np.flatnonzero(removed)[::-1].tolist():
+            self.remove_q.append(self.trajectories.remove(i))
+
+    def may_collide(self, last_pos, pos):
+        """Return a boolean array which is False for the balls whose segments of this frame
+           are clear of the terrain, the walker, natures and the goal gate, so that they need no sweep test.
+            Args:
+                last_pos, pos (numpy.ndarray): the positions of balls before and after moving;
+        """
+        r = self.sweep_shape.get_radius()
+        lower = np.minimum(last_pos, pos) - r
+        upper = np.maximum(last_pos, pos) + r
 
-            self.moving_q.append(ball)
+        w_lower, w_upper = self.walker.get_bounds()
+        mask = np.all((lower <= w_upper) & (upper >= w_lower), axis=1)
 
-    def will_collide(self, pt_from, pt_to):
-        ts_from = TransformState.make_pos(pt_from)
-        ts_to = TransformState.make_pos(pt_to)
-        test_shape = BulletSphereShape(0.5)
+        # Natures and the goal gate are tested with the circle containing the segment.
+        center = (last_pos + pos) / 2
+        reach = np.linalg.norm(pos - last_pos, axis=1) / 2 + r
+        mask |= ~self.placer.filter_keepouts(center[:, 0], center[:, 1], reach)
+
+        for i in np.flatnonzero(~mask).tolist():
+            x0, y0, z0 = lower[i].tolist()
+            x1, y1, _ = upper[i].tolist()
+            mask[i] = z0 <= self.sampler.get_max_height(x0, y0, x1, y1) \
+                or self.placer.overlaps(center[i, 0], center[i, 1], reach[i], collision=True)
+
+        return mask
+
+    def find_collisions(self, last_pos, pos):
+        """Return a boolean array which is True for the balls which hit something in this frame.
+           Bullet sweep tests are run only for the balls which may collide.
+        """
+        hits = np.zeros(len(pos), dtype=bool)
+        candidates = self.may_collide(last_pos, pos)
+        self.rejected += len(pos) - int(np.count_nonzero(candidates))
+
+        # The end of a sweep is the start of the ball's next one, so its state is made only once.
+        states = self.trajectories.states
+        last_states = self.trajectories.last_states
+
+        for i in np.flatnonzero(candidates).tolist():
+            if (ts_from := last_states[i]) is None:
+                ts_from = TransformState.make_pos(Point3(*last_pos[i]))
+
+            states[i] = TransformState.make_pos(Point3(*pos[i]))
+            hits[i] = self.will_collide(ts_from, states[i])
+
+        return hits
+
+    def will_collide(self, ts_from, ts_to):
+        """Args:
+            ts_from, ts_to (TransformState): the positions of a ball before and after moving;
+        """
+        self.sweeps += 1
 
         if (result := self.world.sweep_test_closest(
-                test_shape, ts_from, ts_to, Mask.environment, 0.0)).has_hit():
+                self.sweep_shape, ts_from, ts_to, Mask.environment, 0.0)).has_hit():
             if result.get_node() == self.walker.node():
                 self.score_display.add(hit=1)
             else:
@@ -0,0 +1,167 @@
+import math
+from collections import deque
+
+import numpy as np
+from panda3d.core import Point3
+
+from constants import Mask
+
+
+class CameraSolver:
+    """Keep the walker in the view of the camera following it. The view is checked
+       only after the walker or the camera has moved, and when it is blocked, candidates
+       around the walker are searched outward from the last angle which had a clear view.
+       At most max_rays rays are cast per frame; the rest of a search is carried over.
+        Args:
+            world (BulletWorld): the world where rays are cast;
+            walker (Walker): the character followed by the camera;
+            camera (NodePath): the camera, whose parent is the walker;
+            target (NodePath): the point which the camera looks at;
+            threshold (float): the distance the walker or the camera must move before the view is checked again;
+            max_rays (int): the upper limit of rays cast per frame;
+            step (int): the angle in degrees between candidates;
+            pyramid (HeightPyramid): if given, candidates blocked by the terrain are rejected together without Bullet rays;
+    """
+
+    def __init__(self, world, walker, camera, target, threshold=0.25, max_rays=6, step=10, pyramid=None):
+        self.world = world
+        self.walker = walker
+        self.camera = camera
+        self.target = target
+        self.threshold = threshold
+        self.max_rays = max_rays
+        self.step = step
+        self.pyramid = pyramid
+
+        self.last_angle = 0
+        self.pending = deque()
+        self.walker_pos = None
+        self.camera_pos = None
+
+        self.rays = 0
+        self.frames = 0
+        self.total_rays = 0
+        self.max_frame_rays = 0
+        self.searches = 0
+        self.failed = 0
+        self.screened = 0
+
+    @property
+    def stats(self):
+        return dict(
+            rays=self.rays,
+            rays_per_frame=self.total_rays / self.frames if self.frames else 0,
+            max_frame_rays=self.max_frame_rays,
+            searches=self.searches,
+            failed=self.failed,
+            screened=self.screened
+        )
+
+    def is_visible(self, camera_pos, walker_pos):
+        self.rays += 1
+
+        if (result := self.world.ray_test_closest(
+                camera_pos, walker_pos, Mask.environment)).has_hit():
+            return result.get_node() == self.walker.node()
+
+        return False
+
+    def has_moved(self, walker_pos, camera_pos):
+        if self.walker_pos is None:
+            return True
+
+        return (walker_pos - self.walker_pos).length() > self.threshold \
+            or (camera_pos - self.camera_pos).length() > self.threshold
+
+    def get_angle(self, pos):
+        """Return the angle in degrees from the default camera position to a position relative to the walker."""
+        default = self.walker.navigate()
+        return math.degrees(math.atan2(
+            default.x * pos.y - default.y * pos.x, default.x * pos.x + default.y * pos.y))
+
+    def get_search_angles(self, blocked_angle):
+        """Return the angles to be tested: the default position behind the walker first,
+           then outward from the last angle with a clear view, on both sides by turns.
+        """
+        angles = [0]
+
+        for i in range(1, 360 // self.step + 1):
+            times = (i + 1) // 2
+            angles.append(self.last_angle + (self.step * times if i % 2 else -self.step * times))
+
+        angles = [(angle + 180) % 360 - 180 for angle in angles]
+        blocked_angle = (blocked_angle + 180) % 360 - 180
+        return list(dict.fromkeys(angle for angle in angles if abs(angle - blocked_angle) > 1e-3))
+
+    def get_candidates(self, angles):
+        """Return the positions relative to the walker made by turning the default position."""
+        default = self.walker.navigate()
+        rad = np.radians(angles)
+        cos, sin = np.cos(rad), np.sin(rad)
+        return np.stack([
+            default.x * cos - default.y * sin,
+            default.x * sin + default.y * cos,
+            np.full(len(angles), default.z)
+        ], axis=1)
+
+    def screen(self, angles, walker_pos):
+        """Return the angles whose candidates are not blocked by the terrain.
+           Rays stop at the surface of the walker, like Bullet rays hitting the walker first.
+        """
+        offsets = self.get_candidates(angles)
+        lower, upper = self.walker.get_bounds()
+        radius = (upper.x - lower.x) / 2
+        ratio = radius / np.linalg.norm(offsets, axis=1)[:, None]
+
+        center = np.array(walker_pos)
+        fractions = self.pyramid.ray_test_batch(offsets + center, offsets * ratio + center)
+        clear = np.isnan(fractions).tolist()
+        self.screened += clear.count(False)
+        return [angle for angle, is_clear in zip(angles, clear) if is_clear]
+
+    def update(self):
+        self.rays = 0
+        walker_pos = self.walker.get_pos()
+        camera_pos = self.camera.get_pos() + walker_pos
+
+        if self.pending or self.has_moved(walker_pos, camera_pos):
+            self.walker_pos = walker_pos
+            self.camera_pos = camera_pos
+            self.solve(walker_pos, camera_pos)
+
+        self.frames += 1
+        self.total_rays += self.rays
+        self.max_frame_rays = max(self.max_frame_rays, self.rays)
+
+    def solve(self, walker_pos, camera_pos):
+        if not self.pending:
+            angle = self.get_angle(self.camera.get_pos())
+
+            if self.is_visible(camera_pos, walker_pos):
+                self.last_angle = angle
+                return
+
+            angles = self.get_search_angles(angle)
+
+            if self.pyramid is not None:
+                angles = self.screen(angles, walker_pos)
+
+            self.pending.extend(angles)
+            self.searches += 1
+
+        n = min(self.max_rays - self.rays, len(self.pending))
+        angles = [self.pending.popleft() for _ in range(n)]
+
+        # Bullet rays are cast one by one: Panda3D has no call to cast many segments at once,
+        # and the search stops at the first clear candidate, so the rest of the budget is saved.
+        for angle, (x, y, z) in zip(angles, self.get_candidates(angles).tolist()):
+            if self.is_visible(Point3(x, y, z) + walker_pos, walker_pos):
+                self.camera.set_pos(x, y, z)
+                self.camera.look_at(self.target)
+                self.camera_pos = self.camera.get_pos() + walker_pos
+                self.last_angle = angle
+                self.pending.clear()
+                return
+
+        if not self.pending:
+            self.failed += 1
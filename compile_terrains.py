@@ -0,0 +1,65 @@
+"""Compile the elevation data in terrains/<x>_<y>/ into terrain packs,
+   so that a terrain change does not need to parse text files.
+
+   >>>python compile_terrains.py [--force]
+"""
+import argparse
+
+from heightmap import HeightMap, Files
+from terrain_creator import select_texture_set
+from terrain_pack import VERSION, PackError, get_pack_path, read_pack, write_pack
+
+
+def is_up_to_date(heightmap, dir):
+    try:
+        if (pack := read_pack(get_pack_path(dir))) is None:
+            return False
+    except PackError:
+        return False
+
+    meta, _ = pack
+    return meta.get('sources') == heightmap.get_source_stamps(dir)
+
+
+def compile_pack(heightmap, dir):
+    data = heightmap.build_from_dem(dir)
+    ratio = data.hist.binarize()
+
+    arrays = dict(heightmap=data.img, hist=data.hist.hist)
+
+    for name in Files.get_tile_names():
+        tile = data.tiles[name]
+        arrays[f'{name}/hist'] = tile.hist.hist
+        arrays[f'{name}/rows'] = tile.rows.astype('u2')
+        arrays[f'{name}/cols'] = tile.cols.astype('u2')
+        arrays[f'{name}/areas'] = tile.areas
+
+    meta = dict(
+        sources=heightmap.get_source_stamps(dir),
+        ratio=ratio,
+        texture_set=select_texture_set(ratio).__name__
+    )
+
+    path = get_pack_path(dir)
+    write_pack(path, arrays, meta)
+    return path, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile terrain packs.')
+    parser.add_argument('--force', action='store_true', help='compile packs even if they are up to date')
+    args = parser.parse_args()
+
+    heightmap = HeightMap()
+
+    for dir in sorted(heightmap.find_dirs()):
+        if not args.force and is_up_to_date(heightmap, dir):
+            print(f'{dir}: up to date')
+            continue
+
+        path, meta = compile_pack(heightmap, dir)
+        print(f'{dir}: wrote {path} (version {VERSION}, {meta["texture_set"]})')
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,34 @@ class Config(metaclass=ConstantsMeta):
     backward = 1
 
 
+class LODConfig(metaclass=ConstantsMeta):
+
+    near = 60
+    far = 150
+    hysteresis = 10
+
+
+class SimulationConfig(metaclass=ConstantsMeta):
+    """The simulation is advanced rate times per second, and at most max_substeps times per frame."""
+
+    rate = 60
+    max_substeps = 5
+
+
+class SplatConfig(metaclass=ConstantsMeta):
+    """The height bands of the four terrain textures. The weight of a band is 1
+       at max and 0 at the distance of (max - min) from max. Heights are divided by scale.
+    """
+
+    scale = 500
+    bands = (
+        (-100, 0),
+        (1, 100),
+        (101, 300),
+        (301, 500)
+    )
+
+
 class Mask(metaclass=ConstantsMeta):
 
     terrain = BitMask32.bit(1)
@@ -30,6 +58,14 @@ class Mask(metaclass=ConstantsMeta):
     environment = BitMask32.bit(1) | BitMask32.bit(2)
 
 
+class CameraMask(metaclass=ConstantsMeta):
+
+    main = BitMask32.bit(0)
+    dynamic_shadow = BitMask32.bit(1)
+    static_shadow = BitMask32.bit(2)
+
+
 class FolderPath(metaclass=ConstantsMeta):
 
-    terrains = 'terrains'
\ No newline at end of file
+    terrains = 'terrains'
+    cache = 'cache'
\ No newline at end of file
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from constants import FolderPath
+
+
+class DEMCache:
+    """Cache parsed DEM text files as float32 .npy files and memory-map them
+       on later loads. A cached file is valid as long as the mtime and size
+       of its source text file have not changed.
+        Args:
+            shape (tuple): the expected shape of a parsed tile;
+            root (str): the directory where .npy files are written;
+            max_bytes (int): the upper limit of arrays kept in memory;
+    """
+
+    def __init__(self, shape, root=FolderPath.cache, max_bytes=64 * 1024 * 1024):
+        self.shape = shape
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.arrays = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            disk_hits=self.disk_hits,
+            misses=self.misses,
+            cached=len(self.arrays),
+            nbytes=self.nbytes
+        )
+
+    def get_cache_paths(self, path):
+        cache_dir = self.root / path.parent.name
+        return cache_dir / f'{path.stem}.npy', cache_dir / f'{path.stem}.json'
+
+    def get_stamp(self, path):
+        stat = os.stat(path)
+        return dict(mtime=stat.st_mtime_ns, size=stat.st_size)
+
+    def get(self, path):
+        # A heightmap can be built in a worker thread and in the main thread at the same time.
+        with self.lock:
+            return self.get_array(Path(path))
+
+    def get_array(self, path):
+        stamp = self.get_stamp(path)
+
+        if (item := self.arrays.get(path)) is not None:
+            arr, cached_stamp = item
+            if cached_stamp == stamp:
+                self.arrays.move_to_end(path)
+                self.hits += 1
+                return arr
+
+            self.discard(path)
+
+        if (arr := self.load(path, stamp)) is not None:
+            self.disk_hits += 1
+        else:
+            arr = self.parse(path)
+            self.save(path, stamp, arr)
+            self.misses += 1
+
+        self.keep(path, stamp, arr)
+        return arr
+
+    def parse(self, path):
+        df = pd.read_csv(path, header=None).replace('e', 0)
+        if df.shape != self.shape:
+            raise ValueError(f'Tile size is not {self.shape}')
+
+        return df.values.astype(np.float32)
+
+    def load(self, path, stamp):
+        npy_path, stamp_path = self.get_cache_paths(path)
+
+        try:
+            with open(stamp_path, 'r') as f:
+                if json.load(f) != stamp:
+                    return None
+            arr = np.load(npy_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        if arr.shape != self.shape or arr.dtype != np.float32:
+            return None
+
+        return arr
+
+    def save(self, path, stamp, arr):
+        npy_path, stamp_path = self.get_cache_paths(path)
+        npy_path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(npy_path, arr)
+
+        # Write the stamp last, so that an interrupted save is never treated as valid.
+        with open(stamp_path, 'w') as f:
+            json.dump(stamp, f)
+
+    def keep(self, path, stamp, arr):
+        self.arrays[path] = (arr, stamp)
+        self.nbytes += arr.nbytes
+
+        while self.nbytes > self.max_bytes and len(self.arrays) > 1:
+            oldest = next(iter(self.arrays))
+            self.discard(oldest)
+
+    def discard(self, path):
+        arr, _ = self.arrays.pop(path)
+        self.nbytes -= arr.nbytes
+
+    def clear(self):
+        self.arrays.clear()
+        self.nbytes = 0
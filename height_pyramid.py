@@ -0,0 +1,177 @@
+import numpy as np
+from panda3d.core import Point3
+
+
+class HeightPyramid:
+    """Cast rays against the terrain surface without Bullet, using a pyramid of
+       the min and max heights of the heightmap cells. A ray skips a whole block of
+       cells if it passes above its max height or below its min height; only the cells
+       left are tested with the same triangles as BulletHeightfieldShape with diamond
+       subdivision. As in Bullet, the surface is hit from both sides.
+       Rays of any direction are marched together with numpy.
+       Hit fractions agree with Bullet ray tests within 1e-4 of the ray length
+       (Bullet works in 32-bit floats).
+        Args:
+            sampler (HeightSampler): the sampler holding the heightmap;
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.max_levels = []
+        self.min_levels = []
+        self.rays = 0
+        self.steps = 0
+
+    @property
+    def stats(self):
+        return dict(
+            levels=len(self.max_levels),
+            rays=self.rays,
+            steps=self.steps
+        )
+
+    def build(self):
+        """Build the pyramid from the heightmap of the sampler.
+           Must be called after the heightmap of the sampler is changed.
+        """
+        heights = self.sampler.heights
+        corners = (heights[:-1, :-1], heights[:-1, 1:], heights[1:, :-1], heights[1:, 1:])
+        self.max_levels = [np.maximum.reduce(corners)]
+        self.min_levels = [np.minimum.reduce(corners)]
+
+        while max(self.max_levels[-1].shape) > 1:
+            self.max_levels.append(self.reduce(self.max_levels[-1], np.maximum, -np.inf))
+            self.min_levels.append(self.reduce(self.min_levels[-1], np.minimum, np.inf))
+
+    def reduce(self, level, func, fill):
+        rows, cols = level.shape
+        level = np.pad(level, ((0, rows % 2), (0, cols % 2)), constant_values=fill)
+        return func.reduce([level[::2, ::2], level[::2, 1::2], level[1::2, ::2], level[1::2, 1::2]])
+
+    def ray_test(self, pt_from, pt_to):
+        """Return the first point where a ray hits the terrain, or None.
+            Args:
+                pt_from, pt_to (Point3): the start and end points of the ray;
+        """
+        fraction = self.ray_test_batch(np.array([pt_from]), np.array([pt_to]))[0]
+
+        if np.isnan(fraction):
+            return None
+
+        return pt_from + (pt_to - pt_from) * float(fraction)
+
+    def ray_test_batch(self, starts, ends):
+        """Return the hit fractions of rays, which are nan for the rays hitting nothing.
+            Args:
+                starts, ends (numpy.ndarray): the start and end points of the rays, shaped (n, 3);
+        """
+        starts = np.asarray(starts, dtype=np.float64).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=np.float64).reshape(-1, 3)
+        self.rays += len(starts)
+
+        # Rays are marched in grid coordinates, where a cell of the heightmap is 1 x 1.
+        half = self.sampler.half
+        origin = np.stack([starts[:, 0] + half, half - starts[:, 1]], axis=1)
+        delta = np.stack([ends[:, 0] - starts[:, 0], starts[:, 1] - ends[:, 1]], axis=1)
+        z0 = starts[:, 2]
+        dz = ends[:, 2] - starts[:, 2]
+
+        t, t_end = self.clip(origin, delta, self.sampler.size)
+        fractions = np.full(len(starts), np.nan)
+        level = np.full(len(starts), len(self.max_levels) - 1)
+        idx = np.flatnonzero(t <= t_end)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            while len(idx):
+                self.steps += 1
+                hit, exit_t = self.step(idx, t, t_end, level, origin, delta, z0, dz, starts, ends)
+                fractions[idx[~np.isnan(hit)]] = hit[~np.isnan(hit)]
+
+                advanced = np.isnan(hit) & (exit_t >= 0)
+                t[idx[advanced]] = exit_t[advanced]
+                idx = idx[np.isnan(hit) & (np.where(exit_t >= 0, exit_t, t[idx]) < t_end[idx])]
+
+        return fractions
+
+    def clip(self, origin, delta, size):
+        """Return the range of t where the rays are over the terrain."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0 = (0 - origin) / delta
+            t1 = (size - origin) / delta
+
+        near = np.where(delta == 0, np.where((origin >= 0) & (origin <= size), -np.inf, np.inf), np.minimum(t0, t1))
+        far = np.where(delta == 0, np.where((origin >= 0) & (origin <= size), np.inf, -np.inf), np.maximum(t0, t1))
+        return np.maximum(near.max(axis=1), 0), np.minimum(far.min(axis=1), 1)
+
+    def step(self, idx, t, t_end, level, origin, delta, z0, dz, starts, ends):
+        """March the rays of idx by one block of their levels.
+           Returns the hit fractions, which are nan where the rays do not hit in the block,
+           and the t where the rays leave the blocks, which is -1 where the rays go down a level.
+        """
+        lv = level[idx]
+        ti = t[idx]
+        org = origin[idx]
+        d = delta[idx]
+        size = np.left_shift(1, lv)[:, None]
+
+        # Nudge the point along the ray, so that a point on an edge belongs to the block ahead.
+        g = org + d * ti[:, None] + np.sign(d) * 1e-7
+        cell = np.floor(g / size).astype(np.int64)
+        bound = (cell + (d > 0)) * size
+        exits = np.where(d == 0, np.inf, (bound - org) / d)
+        exit_t = np.minimum(exits.min(axis=1), t_end[idx])
+
+        z_in = z0[idx] + dz[idx] * ti
+        z_out = z0[idx] + dz[idx] * exit_t
+        ray_low = np.minimum(z_in, z_out)
+        ray_high = np.maximum(z_in, z_out)
+        block_max = np.empty(len(idx))
+        block_min = np.empty(len(idx))
+
+        for n in np.unique(lv).tolist():
+            sel = lv == n
+            rows, cols = self.max_levels[n].shape
+            r = np.clip(cell[sel, 1], 0, rows - 1)
+            c = np.clip(cell[sel, 0], 0, cols - 1)
+            block_max[sel] = self.max_levels[n][r, c]
+            block_min[sel] = self.min_levels[n][r, c]
+
+        hit = np.full(len(idx), np.nan)
+        skip = (ray_low > block_max) | (ray_high < block_min)
+        leaf = ~skip & (lv == 0)
+
+        if leaf.any():
+            hit[leaf] = self.intersect(idx[leaf], ti[leaf], exit_t[leaf], org[leaf], d[leaf], starts, ends)
+
+        # Go up a level after leaving a block, and down a level where the block cannot be skipped.
+        level[idx[skip | leaf]] = np.minimum(lv[skip | leaf] + 1, len(self.max_levels) - 1)
+        descend = ~skip & (lv > 0)
+        level[idx[descend]] = lv[descend] - 1
+        exit_t[descend] = -1
+        return hit, exit_t
+
+    def intersect(self, idx, t0, t1, org, d, starts, ends):
+        """Return the fractions where the rays cross the two triangles of a cell between t0 and t1, or nan.
+           Each triangle is a plane, so the height of a ray over the surface is linear on each side of the diagonal.
+        """
+        g0 = org + d * t0[:, None]
+        cell = np.floor(g0 + np.sign(d) * 1e-7)
+        f0 = g0 - cell
+
+        # The diagonal is fx = fy in cells whose column + row is even, and fx + fy = 1 in the others.
+        even = (cell.sum(axis=1) % 2) == 0
+        num = np.where(even, f0[:, 1] - f0[:, 0], 1 - f0[:, 0] - f0[:, 1])
+        den = np.where(even, d[:, 0] - d[:, 1], d[:, 0] + d[:, 1])
+        t_split = t0 + num / den
+        tm = np.where((t_split > t0) & (t_split < t1), t_split, t1)
+
+        def gap(t):
+            pts = starts[idx] + (ends[idx] - starts[idx]) * t[:, None]
+            return pts[:, 2] - self.sampler.interpolate(pts[:, 0], pts[:, 1])
+
+        h0, hm, h1 = gap(t0), gap(tm), gap(t1)
+        return np.select(
+            [h0 == 0, h0 * hm <= 0, hm * h1 <= 0],
+            [t0, t0 + (tm - t0) * h0 / (h0 - hm), tm + (t1 - tm) * hm / (hm - h1)],
+            np.nan
+        )
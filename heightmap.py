@@ -1,15 +1,18 @@
 import random
 import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from enum import StrEnum, IntEnum
 from itertools import cycle
 from pathlib import Path
 
-import pandas as pd
 import numpy as np
 import cv2
 from panda3d.core import Point2
+from panda3d.core import PNMImage, Texture
 
 from constants import FolderPath
+from dem_cache import DEMCache
+from terrain_pack import PackError, get_pack_path, read_pack
 
 
 class Areas(IntEnum):
@@ -20,6 +23,17 @@ class Areas(IntEnum):
     SUBALPINE = 160
     ALPINE = 200
 
+    @classmethod
+    def label(cls, img):
+        """Return an array in which each pixel is replaced with its area value,
+           or 0 if the pixel does not belong to any area.
+            Args:
+                img (numpy.ndarray): 8-bit heightmap.
+        """
+        lut = np.zeros(256, dtype=np.uint8)
+        lut[list(cls)] = list(cls)
+        return lut[img]
+
 
 class Files(StrEnum):
 
@@ -38,35 +52,173 @@ class Files(StrEnum):
         return [mem for mem in cls if mem != cls.HEIGHTMAP]
 
 
+def to_gray(img):
+    """Return the 8-bit image that cv2.imread used to give for a 16-bit heightmap.
+        Args:
+            img (numpy.ndarray): 16-bit heightmap.
+    """
+    return (img >> 8).astype(np.uint8)
+
+
+class Histogram:
+    """Index of an 8-bit image to count pixels in any range of values
+       without scanning the image again.
+        Args:
+            hist (numpy.ndarray): the number of pixels of each value.
+    """
+
+    def __init__(self, hist):
+        self.hist = hist
+        self.cumsum = np.cumsum(self.hist)
+        self.total = int(self.cumsum[-1])
+
+    @classmethod
+    def from_image(cls, img, bins=256):
+        return cls(np.bincount(img.ravel(), minlength=bins))
+
+    def count(self, start, end):
+        start = max(start, 0)
+        end = min(end, len(self.hist) - 1)
+
+        if start > end:
+            return 0
+
+        count = self.cumsum[end] - (self.cumsum[start - 1] if start > 0 else 0)
+        return int(count)
+
+    def otsu_threshold(self):
+        """Return the same threshold as cv2.threshold with THRESH_OTSU.
+           Pixels whose values are greater than the threshold are white.
+        """
+        eps = np.finfo(np.float32).eps
+        p = self.hist / self.total
+        levels = np.arange(len(p))
+
+        q1 = np.cumsum(p)
+        q2 = 1 - q1
+        m1 = np.cumsum(levels * p)
+        mu = m1[-1]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mu1 = m1 / q1
+            mu2 = (mu - m1) / q2
+            sigma = q1 * q2 * (mu1 - mu2) ** 2
+
+        valid = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1 - eps)
+        sigma = np.where(valid, sigma, 0)
+        return int(np.argmax(sigma))
+
+    def binarize(self):
+        """Return white and black ratio of the image binarized with Otsu's method."""
+        threshold = self.otsu_threshold()
+        white = self.count(threshold + 1, len(self.hist) - 1)
+        black = (self.total - white)
+
+        white_ratio = white / self.total
+        black_ratio = black / self.total
+        return white_ratio, black_ratio
+
+
+class TileData:
+    """Arrays derived from one quadrant of the heightmap. They contain no
+       Panda3D objects, so that they can be made in a worker thread.
+        Args:
+            img (numpy.ndarray): 16-bit view of the quadrant in the whole heightmap;
+            hist (Histogram): the histogram of the 8-bit quadrant;
+            rows, cols, areas (numpy.ndarray): the pixels where natures can be placed;
+    """
+
+    def __init__(self, img, hist, rows, cols, areas):
+        self.img = img
+        self.hist = hist
+        self.rows = rows
+        self.cols = cols
+        self.areas = areas
+
+    @classmethod
+    def from_image(cls, img):
+        gray = to_gray(img)
+        rows, cols, areas = cls.find_candidates(gray)
+        return cls(img, Histogram.from_image(gray), rows, cols, areas)
+
+    @staticmethod
+    def find_candidates(gray):
+        """Find the pixels where natures can be placed, sorted in the order of Areas."""
+        labels = Areas.label(gray)
+        rows, cols = np.nonzero(labels)
+        areas = labels[rows, cols]
+
+        order = np.argsort(areas, kind='stable')
+        return rows[order], cols[order], areas[order]
+
+
+class HeightfieldData:
+    """Everything a terrain build derives from one directory of elevation data.
+        Args:
+            dir (pathlib.Path): the directory of elevation data;
+            img (numpy.ndarray): 16-bit heightmap;
+            hist (Histogram): the histogram of the 8-bit heightmap;
+            tiles (dict): TileData of each quadrant, keyed by Files;
+            ratio (tuple): white and black ratio of the binarized heightmap, if precomputed;
+            texture_set (str): the name of the terrain texture set, if precomputed;
+    """
+
+    def __init__(self, dir, img, hist, tiles, ratio=None, texture_set=None):
+        self.dir = dir
+        self.img = img
+        self.hist = hist
+        self.tiles = tiles
+        self.ratio = ratio
+        self.texture_set = texture_set
+
+
 class Tile:
 
-    def __init__(self, path, center, quadrant, size):
-        self.file = path
+    def __init__(self, name, center, quadrant, size):
+        self.name = name
         self.center = center
         self.quadrant = quadrant
         self.size = size
+        self.data = None
 
-    def get_nature_info(self):
-        img = cv2.imread(self.file)
-
-        for area in Areas:
-            yield from self.generate(img, area)
+    @property
+    def file(self):
+        return self.name.path
 
-    def generate(self, img, area):
-        for x, y in set((x, y) for x, y, _ in zip(*np.where(img == area))):
-            cx, cy = self.change_pixel_to_cartesian(x, y)
-            yield cx, cy, area
+    @property
+    def img(self):
+        return self.data.img
+
+    def set_data(self, data):
+        """Args:
+            data (TileData): arrays of the quadrant.
+        """
+        self.data = data
+        self.pnm = self.make_pnm()
+
+    def make_pnm(self):
+        h, w = self.img.shape
+        tex = Texture(self.name.value)
+        tex.setup_2d_texture(w, h, Texture.T_unsigned_short, Texture.F_luminance)
+        # The first row of a texture is the bottom of the image.
+        tex.set_ram_image(np.ascontiguousarray(self.img[::-1]))
+
+        pnm = PNMImage()
+        tex.store(pnm)
+        return pnm
+
+    def get_nature_info(self, chunk_size=1024):
+        """Yield the positions where natures can be placed as batched arrays
+           of (xs, ys, areas), sorted in the order of Areas.
+        """
+        xs, ys = self.change_pixel_to_cartesian(self.data.rows, self.data.cols)
+        areas = self.data.areas
+
+        for i in range(0, len(areas), chunk_size):
+            yield xs[i:i + chunk_size], ys[i:i + chunk_size], areas[i:i + chunk_size]
 
     def count_pixels(self, start, end):
-        img = cv2.imread(self.file)
-
-        if start < 0:
-            start = 0
-        if end > 255:
-            end = 255
-
-        count = sum(np.count_nonzero(img == i) for i in range(start, end + 1))
-        return count
+        return self.data.hist.count(start, end)
 
     def change_pixel_to_cartesian(self, y, x):
         half = self.size / 2
@@ -77,17 +229,108 @@ class Tile:
         return cx, cy
 
 
+class Prefetcher:
+    """Build the next heightmap in a worker thread while the current round is played.
+        Args:
+            build (callable): the function to make HeightfieldData from a directory;
+            timeout (float): seconds to wait for an unfinished build before cancelling it;
+                             a build which has already started cannot be cancelled,
+                             so it is waited for and its result is used;
+    """
+
+    def __init__(self, build, timeout=0.5):
+        self.build = build
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='heightmap')
+        self.dir = None
+        self.future = None
+
+        self.ready = 0
+        self.waited = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    @property
+    def stats(self):
+        return dict(
+            ready=self.ready,
+            waited=self.waited,
+            timeouts=self.timeouts,
+            cancelled=self.cancelled,
+            failed=self.failed
+        )
+
+    def submit(self, dir):
+        if self.future is None:
+            self.dir = dir
+            self.future = self.executor.submit(self.build, dir)
+
+    def take(self):
+        """Return the submitted directory and its HeightfieldData. The data is
+           None if the build was cancelled before it started or failed; the directory
+           is None if nothing was submitted.
+        """
+        dir, future = self.dir, self.future
+        self.dir = self.future = None
+
+        if future is None:
+            return None, None
+
+        ready = future.done()
+
+        try:
+            data = future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.timeouts += 1
+
+            if future.cancel():
+                self.cancelled += 1
+                return dir, None
+
+            # Building the same directory again here would only compete with the worker.
+            return dir, self.wait(future)
+        except Exception:
+            self.failed += 1
+            return dir, None
+
+        if ready:
+            self.ready += 1
+        else:
+            self.waited += 1
+
+        return dir, data
+
+    def wait(self, future):
+        try:
+            return future.result()
+        except Exception:
+            self.failed += 1
+            return None
+
+
 class HeightMap:
 
-    def __init__(self):
+    def __init__(self, dump=False):
         self.heightmap = Files.HEIGHTMAP.path
+        self.dump = dump
         self.tile_size = 256
+        self.data = None
         self.tiles = [tile for tile in self.get_tiles()]
+        self.dem_cache = DEMCache((self.tile_size, self.tile_size))
+        self.prefetcher = Prefetcher(self.build)
 
-        dirs = [p for p in Path(FolderPath.terrains).glob('**') if re.search(r'\d+_\d+', str(p))]
+        dirs = self.find_dirs()
         random.shuffle(dirs)
         self.dirs = cycle(dirs)
 
+    def find_dirs(self):
+        return [p for p in Path(FolderPath.terrains).glob('**') if re.search(r'\d+_\d+', str(p))]
+
+    @property
+    def img(self):
+        return self.data.img
+
     def get_tiles(self):
         half = self.tile_size / 2
 
@@ -107,38 +350,106 @@ class HeightMap:
                     quadrant = 4
 
             center = pt * half
-            tile = Tile(file.path, center, quadrant, self.tile_size)
+            tile = Tile(file, center, quadrant, self.tile_size)
             yield tile
 
     def binarize(self):
-        img_gray = cv2.cvtColor(cv2.imread(self.heightmap), cv2.COLOR_BGR2GRAY)
-        _, img = cv2.threshold(img_gray, 0, 255, cv2.THRESH_OTSU)
-        total = img.size
-        white = cv2.countNonZero(img)
-        black = (total - white)
-
-        white_ratio = white / total
-        black_ratio = black / total
-        return white_ratio, black_ratio
+        if self.data.ratio is not None:
+            return self.data.ratio
+
+        return self.data.hist.binarize()
+
+    def prefetch(self):
+        """Start building the next heightmap in the background."""
+        self.prefetcher.submit(next(self.dirs))
 
     def create(self):
-        dir = next(self.dirs)
+        dir, data = self.prefetcher.take()
+
+        if data is None:
+            data = self.build(dir or next(self.dirs))
+
+        self.data = data
+
+        for tile in self.tiles:
+            tile.set_data(data.tiles[tile.name])
+
+        if self.dump:
+            self.save()
+
+    def build(self, dir):
+        if (data := self.load_pack(dir)) is not None:
+            return data
+
+        return self.build_from_dem(dir)
+
+    def build_from_dem(self, dir):
         img = self.make_image(dir)
-        cv2.imwrite(self.heightmap, img)
+        hist = Histogram.from_image(to_gray(img))
+        tiles = {name: TileData.from_image(self.crop(img, name)) for name in Files.get_tile_names()}
+        return HeightfieldData(dir, img, hist, tiles)
+
+    def load_pack(self, dir):
+        """Return HeightfieldData from the terrain pack compiled by compile_terrains.py,
+           or None if the pack does not exist, is out of date or is corrupt.
+        """
+        try:
+            if (pack := read_pack(get_pack_path(dir))) is None:
+                return None
+
+            meta, arrays = pack
+            if meta.get('sources') != self.get_source_stamps(dir):
+                return None
+
+            return self.make_data_from_pack(dir, meta, arrays)
+        except PackError:
+            return None
+
+    def make_data_from_pack(self, dir, meta, arrays):
+        try:
+            img = arrays['heightmap']
+            tiles = {}
+
+            for name in Files.get_tile_names():
+                tiles[name] = TileData(
+                    self.crop(img, name),
+                    Histogram(arrays[f'{name}/hist']),
+                    arrays[f'{name}/rows'],
+                    arrays[f'{name}/cols'],
+                    arrays[f'{name}/areas']
+                )
+
+            return HeightfieldData(
+                dir, img, Histogram(arrays['hist']), tiles, tuple(meta['ratio']), meta['texture_set'])
+        except KeyError as e:
+            raise PackError(f'{get_pack_path(dir)}: missing {e}') from e
+
+    def get_source_files(self, dir):
+        x, y = [int(s) for s in dir.name.split('_')]
+        return [dir / f'{x + _x}_{y + _y}.txt' for _x, _y in [[0, 0], [1, 0], [0, 1], [1, 1]]]
+
+    def get_source_stamps(self, dir):
+        return {path.name: self.dem_cache.get_stamp(path) for path in self.get_source_files(dir)}
+
+    def crop(self, img, name):
         h = w = self.tile_size + 1
 
-        for tile in self.tiles:
-            match Path(tile.file).stem:
-                case Files.TOP_RIGHT:
-                    cropped_img = img[:h, w - 1:w * 2 - 1]
-                case Files.TOP_LEFT:
-                    cropped_img = img[:h, :w]
-                case Files.BOTTOM_LEFT:
-                    cropped_img = img[h - 1:h * 2 - 1, :w]
-                case Files.BOTTOM_RIGHT:
-                    cropped_img = img[h - 1:h * 2 - 1, w - 1:w * 2 - 1]
+        match name:
+            case Files.TOP_RIGHT:
+                return img[:h, w - 1:w * 2 - 1]
+            case Files.TOP_LEFT:
+                return img[:h, :w]
+            case Files.BOTTOM_LEFT:
+                return img[h - 1:h * 2 - 1, :w]
+            case Files.BOTTOM_RIGHT:
+                return img[h - 1:h * 2 - 1, w - 1:w * 2 - 1]
 
-            cv2.imwrite(tile.file, cropped_img)
+    def save(self):
+        """Write the heightmap and its quadrants to png files for debugging."""
+        cv2.imwrite(self.heightmap, self.img)
+
+        for tile in self.tiles:
+            cv2.imwrite(tile.file, tile.img)
 
     def make_image(self, dir):
         x, y = [int(s) for s in dir.name.split('_')]
@@ -155,13 +466,7 @@ class HeightMap:
         return img
 
     def get_array(self, path):
-        expect_size = (self.tile_size, self.tile_size)
-
-        df = pd.read_csv(path, header=None).replace('e', 0)
-        if df.shape != expect_size:
-            raise ValueError(f'Tile size is not {expect_size}')
-
-        return df.values
+        return self.dem_cache.get(path)
 
     def enlarge(self, arr, edge=-1):
         bottom = arr[edge:, :]
@@ -1,6 +1,10 @@
 from panda3d.core import AmbientLight, DirectionalLight
-from panda3d.core import NodePath, PandaNode
-from panda3d.core import Vec3, Point3, LColor
+from panda3d.core import NodePath, PandaNode, Camera, OrthographicLens
+from panda3d.core import FrameBufferProperties, WindowProperties, GraphicsPipe, GraphicsOutput
+from panda3d.core import Texture, SamplerState, Shader
+from panda3d.core import Vec3, Point3, LColor, Mat4
+
+from constants import CameraMask
 
 
 class BasicAmbientLight(NodePath):
@@ -12,22 +16,129 @@ class BasicAmbientLight(NodePath):
 
 
 class BasicDayLight(NodePath):
+    """A directional light with two shadow maps. The static map holds the terrains and natures,
+       and is rendered only when requested after a terrain build, or when the focus has moved
+       far from its center. The dynamic map is the shadow map of the light itself; it is small,
+       follows the focus every frame and holds only the moving objects like the walker and balls.
+       Every shader of the scene samples both maps; nodes without their own shader get shaders/lit_*.glsl.
+        Args:
+            static_size (int): the resolution of the static shadow map;
+            dynamic_size (int): the resolution of the dynamic shadow map;
+            static_film (float): the size of the area covered by the static shadow map;
+            dynamic_film (float): the size of the area covered by the dynamic shadow map;
+            refresh_distance (float): the distance the focus must move before the static map is rendered again;
+    """
 
-    def __init__(self):
+    def __init__(self, static_size=4096, dynamic_size=1024, static_film=256, dynamic_film=48, refresh_distance=64):
         super().__init__(DirectionalLight('directional_light'))
-        self.node().get_lens().set_film_size(200, 200)
+        self.node().get_lens().set_film_size(dynamic_film, dynamic_film)
         self.node().get_lens().set_near_far(10, 200)
         self.node().set_color(LColor(1, 1, 1, 1))
         self.node().setSpecularColor(LColor(1, 1, 1, 1))
         self.set_pos_hpr(Point3(0, 0, 100), Vec3(-30, -45, 0))
 
-        self.node().set_shadow_caster(True, 8192, 8192)
+        self.node().set_shadow_caster(True, dynamic_size, dynamic_size)
+        self.node().set_camera_mask(CameraMask.dynamic_shadow)
         state = self.node().get_initial_state()
         temp = NodePath(PandaNode('temp_np'))
         temp.set_state(state)
         temp.set_depth_offset(-3)
         self.node().set_initial_state(temp.get_state())
 
+        self.refresh_distance = refresh_distance
+        self.static_center = None
+        self.static_renders = 0
+        self.rendering = False
+        self.make_static_shadow(static_size, static_film)
+
         # self.node().showFrustum()
+        base.cam.node().set_camera_mask(CameraMask.main)
         base.render.set_light(self)
-        base.render.set_shader_auto()
\ No newline at end of file
+        base.render.set_shader(Shader.load(Shader.SL_GLSL, 'shaders/lit_v.glsl', 'shaders/lit_f.glsl'))
+
+    @property
+    def shadow_stats(self):
+        return dict(
+            static_renders=self.static_renders,
+            static_center=self.static_center
+        )
+
+    def make_static_shadow(self, size, film):
+        self.static_map = Texture('static_shadow_map')
+        props = FrameBufferProperties()
+        props.set_rgb_color(False)
+        props.set_depth_bits(24)
+        self.static_buffer = base.graphicsEngine.make_output(
+            base.pipe, 'static_shadow', -10, props, WindowProperties.size(size, size),
+            GraphicsPipe.BF_refuse_window, base.win.get_gsg(), base.win)
+        self.static_buffer.add_render_texture(
+            self.static_map, GraphicsOutput.RTM_bind_or_copy, GraphicsOutput.RTP_depth)
+        self.static_map.set_minfilter(SamplerState.FT_shadow)
+        self.static_map.set_magfilter(SamplerState.FT_shadow)
+        self.static_map.set_wrap_u(SamplerState.WM_border_color)
+        self.static_map.set_wrap_v(SamplerState.WM_border_color)
+        self.static_map.set_border_color(LColor(1, 1, 1, 1))
+        self.static_buffer.set_active(False)
+
+        lens = OrthographicLens()
+        lens.set_film_size(film, film)
+        lens.set_near_far(10, 400)
+        self.static_camera = base.render.attach_new_node(Camera('static_shadow_camera', lens))
+        self.static_camera.node().set_camera_mask(CameraMask.static_shadow)
+        self.static_camera.set_hpr(self.get_hpr())
+        self.static_buffer.make_display_region().set_camera(self.static_camera)
+
+        # The natures sample the static map, so it must not be bound while being rendered into.
+        temp = NodePath(PandaNode('temp_np'))
+        temp.set_depth_offset(-3)
+        temp.set_shader_input('static_shadow_map', Texture('dummy'), priority=10)
+        temp.set_shader_input('static_shadow_matrix', Mat4.ident_mat())
+        self.static_camera.node().set_initial_state(temp.get_state())
+
+        base.render.set_shader_input('static_shadow_map', self.static_map)
+        base.render.set_shader_input('static_shadow_matrix', Mat4.ident_mat())
+
+    def set_casters(self, static_root, *static_nodes):
+        """Args:
+            static_root (NodePath): the root of the nodes rendered into the static shadow map;
+            static_nodes (NodePath): the nodes not rendered into the dynamic shadow map;
+        """
+        self.static_camera.node().set_scene(static_root)
+
+        for nodepath in static_nodes:
+            nodepath.hide(CameraMask.dynamic_shadow)
+
+    def render_static(self, center):
+        """Render the static shadow map once around a point.
+            Args:
+                center (Point3): the center of the area covered by the static shadow map.
+        """
+        self.static_center = Point3(center.x, center.y, 0)
+        forward = self.get_quat(base.render).get_forward()
+        self.static_camera.set_pos(self.static_center - forward * 200)
+        self.static_buffer.set_active(True)
+        self.rendering = True
+        self.static_renders += 1
+
+    def update(self, focus):
+        """Move the dynamic shadow map to the focus, and render the static shadow map
+           again if the focus has moved far from its center.
+            Args:
+                focus (Point3): the position of the walker.
+        """
+        if self.rendering:
+            self.static_buffer.set_active(False)
+            self.rendering = False
+
+        if self.static_center is not None and \
+                (focus.xy - self.static_center.xy).length() > self.refresh_distance:
+            self.render_static(focus)
+
+        forward = self.get_quat(base.render).get_forward()
+        self.set_pos(focus - forward * 100)
+
+        # Convert the view space of the main camera into the texture space of the static map.
+        lens = self.static_camera.node().get_lens()
+        mat = base.cam.get_mat(self.static_camera) * lens.get_projection_mat()
+        mat *= Mat4.scale_mat(0.5) * Mat4.translate_mat(0.5, 0.5, 0.5)
+        base.render.set_shader_input('static_shadow_matrix', mat)
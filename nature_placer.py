@@ -0,0 +1,131 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+from panda3d.bullet import BulletBoxShape
+from panda3d.core import Vec3
+
+
+class NaturePlacer:
+    """Decide where natures can be placed with a spatial hash, instead of
+       sweeping a sphere through the Bullet world for each candidate.
+       A candidate is rejected if a circle of test_radius around it overlaps
+       a placed obstacle or a keep-out rectangle like the goal gate foundation.
+        Args:
+            test_radius (float): the radius of the circle that must be free;
+            cell_size (float): the size of a cell of the spatial hash;
+    """
+
+    def __init__(self, test_radius=4, cell_size=8):
+        self.test_radius = test_radius
+        self.cell_size = cell_size
+        self.clear()
+
+    def clear(self):
+        self.cells = defaultdict(list)
+        self.keepouts = []
+        self.max_radius = 0
+        self.max_collision_radius = 0
+        self.placed = 0
+        self.tested = 0
+
+    def get_cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, x, y, radius, collision_radius=None):
+        """Register an obstacle.
+            Args:
+                x, y (float): the center of the obstacle;
+                radius (float): the radius of the footprint used to keep obstacles apart;
+                collision_radius (float): the radius of the circle containing the collision shape; radius by default;
+        """
+        if collision_radius is None:
+            collision_radius = radius
+
+        self.cells[self.get_cell(x, y)].append((x, y, radius, collision_radius))
+        self.max_radius = max(self.max_radius, radius)
+        self.max_collision_radius = max(self.max_collision_radius, collision_radius)
+        self.placed += 1
+
+    def add_keepout(self, nodepath):
+        """Register the footprint of a BulletRigidBodyNode, like the goal gate foundation and poles.
+           A box shape is measured by its half extents, and other shapes, like the convex hulls
+           of the poles, by the tight bounds of the geometry under the node. Both include the margin.
+            Args:
+                nodepath (NodePath): the NodePath of the BulletRigidBodyNode.
+        """
+        shape = nodepath.node().get_shape(0)
+
+        if isinstance(shape, BulletBoxShape):
+            center = nodepath.node().get_shape_transform(0).get_pos()
+            half = shape.get_half_extents_with_margin()
+        else:
+            lower, upper = nodepath.get_tight_bounds(nodepath)
+            center = (lower + upper) / 2
+            half = (upper - lower) / 2 + Vec3(shape.get_margin())
+
+        pos = base.render.get_relative_point(nodepath, center)
+        rad = math.radians(nodepath.get_h(base.render))
+        self.keepouts.append((pos.x, pos.y, math.cos(rad), math.sin(rad), half.x, half.y))
+
+    def is_free(self, x, y):
+        self.tested += 1
+        return not self.overlaps(x, y, self.test_radius)
+
+    def overlaps(self, x, y, radius, collision=False):
+        """Return True if a circle overlaps a placed obstacle.
+            Args:
+                x, y (float): the center of the circle;
+                radius (float): the radius of the circle;
+                collision (bool): if True, the collision radii of obstacles are used instead of their footprints;
+        """
+        reach = radius + (self.max_collision_radius if collision else self.max_radius)
+        n = math.ceil(reach / self.cell_size)
+        cx, cy = self.get_cell(x, y)
+
+        for i in range(cx - n, cx + n + 1):
+            for j in range(cy - n, cy + n + 1):
+                if (i, j) not in self.cells:
+                    continue
+
+                for ox, oy, r, collision_r in self.cells[(i, j)]:
+                    limit = radius + (collision_r if collision else r)
+                    if (ox - x) ** 2 + (oy - y) ** 2 < limit * limit:
+                        return True
+
+        return False
+
+    def filter_keepouts(self, xs, ys, radius=None):
+        """Return a boolean array which is True where candidates are
+           far enough from every keep-out rectangle.
+            Args:
+                xs, ys (numpy.ndarray): the candidates;
+                radius (float or numpy.ndarray): the distance required; test_radius by default;
+        """
+        if radius is None:
+            radius = self.test_radius
+
+        mask = np.ones(len(xs), dtype=bool)
+
+        for px, py, cos, sin, hx, hy in self.keepouts:
+            dx = xs - px
+            dy = ys - py
+            lx = np.abs(dx * cos + dy * sin)
+            ly = np.abs(-dx * sin + dy * cos)
+            dist = np.hypot(np.maximum(lx - hx, 0), np.maximum(ly - hy, 0))
+            mask &= dist >= radius
+
+        return mask
+
+    def thin(self, xs, ys):
+        """Return the indices of candidates, keeping one random candidate in each
+           cell whose diagonal is test_radius. Two candidates in the same cell can
+           never both be accepted, so only the kept ones need to be tested.
+        """
+        size = self.test_radius / math.sqrt(2)
+        order = np.random.permutation(len(xs))
+        cells = np.stack([np.floor(xs[order] / size), np.floor(ys[order] / size)], axis=1)
+        _, first = np.unique(cells, axis=0, return_index=True)
+        idx = order[first]
+        np.random.shuffle(idx)
+        return idx
@@ -1,21 +1,27 @@
 import random
+from collections import Counter, defaultdict
 
+import numpy as np
 from panda3d.core import NodePath, PandaNode
-from panda3d.core import CardMaker, TextureStage
-from panda3d.core import Vec3, TransformState
-from panda3d.core import TransparencyAttrib
+from panda3d.core import CardMaker, TextureStage, Texture, SamplerState
+from panda3d.core import Vec3, Point3, TransformState
+from panda3d.core import TransparencyAttrib, BoundingBox
+from panda3d.core import Shader, Camera, OrthographicLens, FrameBufferProperties, LColor
+from panda3d.core import Geom, GeomTriangles, GeomVertexData, GeomVertexReader, GeomVertexWriter
+from panda3d.core import AlphaTestAttrib, RenderAttrib
 from panda3d.bullet import BulletRigidBodyNode
 from panda3d.bullet import BulletConvexHullShape, BulletCylinderShape, ZUp
 from direct.interval.LerpInterval import LerpTexOffsetInterval
 
 from geomnode_maker import Sphere
-from constants import Mask
+from constants import Mask, LODConfig
 
 
 class WaterSurface(NodePath):
 
     def __init__(self, pos, size=256):
         super().__init__(PandaNode('water_surface'))
+        self.keys = []
         self.setup_water(pos, size)
 
     def setup_water(self, pos, size):
@@ -34,94 +40,611 @@ class WaterSurface(NodePath):
         LerpTexOffsetInterval(surface, 200, (1, 0), (0, 0)).loop()
 
 
+class PrototypeRegistry:
+    """Build the models, textures and collision shapes of natures once and
+       share them among all the instances. Count how many natures refer to each of them.
+    """
+
+    def __init__(self):
+        self.prototypes = {}
+        self.references = Counter()
+
+    @property
+    def stats(self):
+        return dict(
+            prototypes=len(self.prototypes),
+            references=sum(self.references.values())
+        )
+
+    def get(self, key, build):
+        """Return the prototype of the key, building it only at the first call.
+            Args:
+                key (hashable): the key of the prototype;
+                build (callable): the function to build the prototype;
+        """
+        if (prototype := self.prototypes.get(key)) is None:
+            prototype = build()
+            self.prototypes[key] = prototype
+
+        self.references[key] += 1
+        return prototype
+
+    def release(self, keys):
+        for key in keys:
+            self.references[key] -= 1
+
+
+prototypes = PrototypeRegistry()
+
+
+class NaturePool:
+    """Keep retired natures in free lists per species, so that the next terrain
+       reuses them instead of creating nodes, rigid bodies and shapes again.
+       Retired natures must have been removed from the Bullet world already.
+        Args:
+            limit (int): the upper limit of free natures kept per species;
+    """
+
+    def __init__(self, limit=2000):
+        self.limit = limit
+        self.free = defaultdict(list)
+        self.in_use = Counter()
+        self.high_water = Counter()
+
+        self.created = 0
+        self.reused = 0
+        self.trimmed = 0
+
+    @property
+    def stats(self):
+        return dict(
+            created=self.created,
+            reused=self.reused,
+            trimmed=self.trimmed,
+            free=sum(len(natures) for natures in self.free.values()),
+            high_water=dict((nature_type.__name__, n) for nature_type, n in self.high_water.items())
+        )
+
+    def get(self, nature_type, terrain_number, pos):
+        """Return a nature reset to the position, reusing a retired one if possible.
+            Args:
+                nature_type (class): a subclass of Trees or Flowers, or Rock;
+                terrain_number (int): the number of the tile;
+                pos (Point3): the position on the terrain;
+        """
+        if free := self.free[nature_type]:
+            nature = free.pop()
+            nature.reuse(terrain_number, pos)
+            self.reused += 1
+        else:
+            nature = nature_type(terrain_number, pos)
+            self.created += 1
+
+        self.in_use[nature_type] += 1
+        self.high_water[nature_type] = max(self.high_water[nature_type], self.in_use[nature_type])
+        return nature
+
+    def put(self, nature):
+        nature_type = type(nature)
+        nature.detach_node()
+        self.in_use[nature_type] -= 1
+
+        # The pool never holds more natures than a terrain has used at once.
+        if len(free := self.free[nature_type]) < min(self.limit, self.high_water[nature_type]):
+            free.append(nature)
+        else:
+            prototypes.release(nature.keys)
+            self.trimmed += 1
+
+
+class Prototype:
+    """A model shared by all the instances of a species.
+        Args:
+            key (str): the key of the prototype in the registry;
+            model (NodePath): the model;
+    """
+
+    def __init__(self, key, model):
+        self.key = key
+        self.model = model
+        self.bounds = self.model.get_tight_bounds()
+        self.lod_models = None
+
+    @classmethod
+    def load(cls, path, offset=Vec3(0, 0, 0)):
+        """Args:
+            path (str): the model file;
+            offset (Vec3): the position of the model relative to the instance's origin;
+        """
+        def build():
+            model = base.loader.load_model(path)
+            model.set_transform(TransformState.make_pos(offset))
+            model.flatten_strong()
+            return cls(path, model)
+
+        return prototypes.get(path, build)
+
+    @property
+    def height(self):
+        end, tip = self.bounds
+        return (tip - end).z
+
+    @property
+    def reach(self):
+        """The horizontal distance from the origin to the farthest point of the model."""
+        end, tip = self.bounds
+        return max(abs(v) for v in (*end.xy, *tip.xy))
+
+    def get_lod_models(self, cells):
+        """Return the full model, the reduced model and the impostor card, each with
+           True if it must be turned to the camera. Without a window to bake the impostor,
+           the reduced model is used for the farthest band too.
+            Args:
+                cells (int): see make_reduced_model; if 0, the full model is used as the reduced model;
+        """
+        if self.lod_models is None:
+            reduced = self.make_reduced_model(cells) if cells else self.model
+            far = (self.bake_impostor(), True) if base.win else (reduced, False)
+            self.lod_models = [(self.model, False), (reduced, False), far]
+
+        return self.lod_models
+
+    def make_reduced_model(self, cells):
+        """Return a copy of the model simplified by vertex clustering: vertices in the same
+           cell of a grid are moved to their mean, and the triangles collapsed by it are removed.
+            Args:
+                cells (int): the number of cells along each axis of the bounds;
+        """
+        model = self.model.copy_to(NodePath('reduced'))
+        end, tip = self.bounds
+        size = np.maximum(np.array(tip - end) / cells, 1e-6)
+
+        for geom_np in model.find_all_matches('**/+GeomNode'):
+            geom_node = geom_np.node()
+
+            for i in range(geom_node.get_num_geoms()):
+                geom = geom_node.get_geom(i).decompose()
+                vdata = GeomVertexData(geom.get_vertex_data())
+
+                reader = GeomVertexReader(vdata, 'vertex')
+                pts = np.array([tuple(reader.get_data3()) for _ in range(vdata.get_num_rows())])
+                keys = np.clip(np.floor((pts - np.array(end)) / size), 0, cells - 1)
+                _, inverse = np.unique(keys, axis=0, return_inverse=True)
+                inverse = inverse.ravel()
+                means = np.zeros((inverse.max() + 1, 3))
+                np.add.at(means, inverse, pts)
+                means /= np.bincount(inverse)[:, None]
+
+                writer = GeomVertexWriter(vdata, 'vertex')
+                for x, y, z in means[inverse].tolist():
+                    writer.set_data3(x, y, z)
+
+                reduced = Geom(vdata)
+
+                for j in range(geom.get_num_primitives()):
+                    prim = geom.get_primitive(j)
+                    tris = np.array([prim.get_vertex(k) for k in range(prim.get_num_vertices())]).reshape(-1, 3)
+                    a, b, c = inverse[tris].T
+                    tris = tris[(a != b) & (b != c) & (c != a)]
+
+                    triangles = GeomTriangles(Geom.UH_static)
+                    for v0, v1, v2 in tris.tolist():
+                        triangles.add_vertices(v0, v1, v2)
+                    reduced.add_primitive(triangles)
+
+                geom_node.set_geom(i, reduced)
+
+        return model
+
+    def bake_impostor(self, size=128):
+        """Render the model from the side into a texture once and return a card with it.
+            Args:
+                size (int): the size of the texture;
+        """
+        end, tip = self.bounds
+        reach = self.reach
+
+        scene = NodePath('impostor_scene')
+        model = self.model.copy_to(scene)
+        model.set_attrib(AlphaTestAttrib.make(RenderAttrib.M_greater_equal, 0.5))
+
+        lens = OrthographicLens()
+        lens.set_film_size(2 * reach, tip.z - end.z)
+        lens.set_near_far(1, 2 * reach + 2)
+        camera = scene.attach_new_node(Camera('impostor_camera', lens))
+        camera.set_pos(0, -reach - 1, (end.z + tip.z) / 2)
+
+        tex = Texture('impostor')
+        props = FrameBufferProperties()
+        props.set_rgba_bits(8, 8, 8, 8)
+        props.set_depth_bits(16)
+        buffer = base.win.make_texture_buffer('impostor', size, size, tex, to_ram=True, fbp=props)
+        buffer.set_clear_color(LColor(0, 0, 0, 0))
+        buffer.make_display_region().set_camera(camera)
+        base.graphicsEngine.render_frame()
+        base.graphicsEngine.remove_window(buffer)
+        self.make_mipmaps(tex)
+
+        card = CardMaker('impostor')
+        card.set_frame(-reach, reach, end.z, tip.z)
+        card.set_has_normals(True)
+        impostor = NodePath(PandaNode('impostor'))
+        impostor.attach_new_node(card.generate())
+        impostor.set_texture(tex)
+        return impostor
+
+    def make_mipmaps(self, tex):
+        """Make the mipmaps of an impostor, keeping the ratio of texels which pass the alpha test.
+           With plain averaging, the alpha of thin parts like stems falls below the threshold
+           and the impostor fades out in the distance.
+        """
+        size = tex.get_x_size()
+        img = np.frombuffer(memoryview(tex.get_ram_image()), dtype=np.uint8)
+        img = img.reshape(size, size, 4).astype(np.float32) / 255
+        coverage = np.mean(img[..., 3] >= 0.5)
+
+        # Average colors weighted by alpha, so that transparent texels do not darken edges.
+        premultiplied = img.copy()
+        premultiplied[..., :3] *= img[..., 3:]
+        level = 1
+
+        while size > 1:
+            size //= 2
+            premultiplied = premultiplied.reshape(size, 2, size, 2, 4).mean(axis=(1, 3))
+            alpha = premultiplied[..., 3]
+            mipmap = premultiplied.copy()
+            mipmap[..., :3] = np.clip(premultiplied[..., :3] / np.maximum(alpha, 1e-6)[..., None], 0, 1)
+
+            if coverage > 0 and (threshold := np.quantile(alpha, 1 - coverage)) > 0:
+                mipmap[..., 3] = np.clip(alpha * 0.5 / threshold, 0, 1)
+
+            memoryview(tex.make_ram_mipmap_image(level))[:] = (mipmap * 255).round().astype(np.uint8).tobytes()
+            level += 1
+
+        tex.set_minfilter(SamplerState.FT_linear_mipmap_linear)
+
+
+class LODBatch:
+    """The instances of a species in a cell, drawn as one instanced batch per LOD band.
+       Per-instance position, scale and heading are packed into a float texture,
+       which the shaders read with gl_InstanceID.
+        Args:
+            parent (NodePath): the node to which batches are attached;
+            name (str): the name of batches;
+            prototype (Prototype): the prototype of the species;
+            natures (list): the instances;
+            shaders (dict): the shader for models turned to the camera or not;
+    """
+
+    def __init__(self, parent, name, prototype, natures, shaders):
+        self.prototype = prototype
+        self.bands = None
+
+        # (x, y, z, scale) and (cos(h), sin(h), 0, 0) for each instance.
+        self.data = np.zeros((len(natures), 2, 4), dtype=np.float32)
+
+        for i, nature in enumerate(natures):
+            pos = nature.get_pos()
+            rad = np.radians(nature.get_h())
+            self.data[i] = ((pos.x, pos.y, pos.z, nature.get_sx()), (np.cos(rad), np.sin(rad), 0, 0))
+
+        # The sphere containing all the instances, to skip batches which stay in one band.
+        self.center = (self.data[:, 0, :3].min(axis=0) + self.data[:, 0, :3].max(axis=0)) / 2
+        self.radius = np.linalg.norm(self.data[:, 0, :3] - self.center, axis=1).max()
+        self.batches = []
+
+        for i, (model, billboard) in enumerate(prototype.get_lod_models(type(natures[0]).lod_cells)):
+            batch = model.copy_to(parent)
+            batch.set_name(f'{name}_lod{i}')
+            tex = Texture('instance_data')
+            tex.set_minfilter(SamplerState.FT_nearest)
+            tex.set_magfilter(SamplerState.FT_nearest)
+            batch.set_shader(shaders[billboard])
+            batch.set_shader_input('instance_data', tex)
+            batch.node().set_final(True)
+            self.batches.append((batch, tex))
+
+    def update(self, camera_pos, limits, hysteresis):
+        """Move instances to the bands of their distances from the camera.
+           An instance leaves its band only after going beyond a limit by hysteresis.
+           Returns the number of instances which changed bands.
+            Args:
+                camera_pos (numpy.ndarray): the camera position relative to the batches;
+                limits (numpy.ndarray): the distances between the bands;
+                hysteresis (float): the margin around the limits;
+        """
+        lowers = np.concatenate([[-np.inf], limits - hysteresis])
+        uppers = np.concatenate([limits + hysteresis, [np.inf]])
+
+        if self.bands is not None and (self.bands[0] == self.bands).all():
+            dist = np.linalg.norm(self.center - camera_pos)
+            band = self.bands[0]
+            if lowers[band] <= dist - self.radius and dist + self.radius <= uppers[band]:
+                return 0
+
+        dists = np.linalg.norm(self.data[:, 0, :3] - camera_pos, axis=1)
+        bands = np.digitize(dists, limits)
+
+        if self.bands is not None:
+            lower = lowers[self.bands]
+            upper = uppers[self.bands]
+            bands = np.where((dists < lower) | (dists > upper), bands, self.bands)
+
+            if (changed := np.count_nonzero(bands != self.bands)) == 0:
+                return 0
+        else:
+            changed = len(bands)
+
+        self.bands = bands
+
+        for i, (batch, tex) in enumerate(self.batches):
+            self.fill(batch, tex, self.data[bands == i])
+
+        return changed
+
+    def fill(self, batch, tex, data):
+        if len(data) == 0:
+            batch.stash()
+            return
+
+        batch.unstash()
+        tex.setup_2d_texture(2, len(data), Texture.T_float, Texture.F_rgba32)
+        # The components of a ram image are in BGRA order.
+        tex.set_ram_image(np.ascontiguousarray(data[..., [2, 1, 0, 3]]))
+        batch.set_instance_count(len(data))
+
+        # The vertices are moved in the shader, so the bounds cannot be computed by Panda3D.
+        end, tip = self.prototype.bounds
+        scale = data[:, 0, 3].max()
+        reach = self.prototype.reach * scale
+        lower = data[:, 0, :3].min(axis=0) + Vec3(-reach, -reach, end.z * scale)
+        upper = data[:, 0, :3].max(axis=0) + Vec3(reach, reach, tip.z * scale)
+        bounds = BoundingBox(Point3(*lower), Point3(*upper))
+
+        for geom_np in batch.find_all_matches('**/+GeomNode'):
+            geom_np.node().set_bounds(bounds)
+
+    def remove(self):
+        for batch, _ in self.batches:
+            batch.remove_node()
+
+
+class InstancedVegetation:
+    """Draw the instances of each species in a cell with a few instanced calls:
+       the full model near the camera, the reduced model in the middle band,
+       and the impostor card turned to the camera beyond that.
+        Args:
+            root (NodePath): the common ancestor of the cells, where shader inputs are set;
+            near (float): the distance between the full and the reduced models;
+            far (float): the distance between the reduced models and the impostors;
+            hysteresis (float): the margin to keep instances from switching back and forth;
+    """
+
+    def __init__(self, root, near=LODConfig.near, far=LODConfig.far, hysteresis=LODConfig.hysteresis):
+        self.root = root
+        self.shaders = {
+            False: Shader.load(Shader.SL_GLSL, 'shaders/nature_v.glsl', 'shaders/nature_f.glsl'),
+            True: Shader.load(Shader.SL_GLSL, 'shaders/impostor_v.glsl', 'shaders/nature_f.glsl')
+        }
+        self.limits = np.array([near, far], dtype=np.float32)
+        self.hysteresis = hysteresis
+        self.instances = {}
+        self.lod_batches = []
+        self.camera_pos = None
+        self.changed = 0
+        self.root.set_shader_input('camera_pos', Point3(0, 0, 0))
+
+    def add(self, nature, cell):
+        """Args:
+            nature (Trees or Flowers): the instance;
+            cell (NodePath): the node to which the batches of the instance are attached;
+        """
+        key = (cell, nature.prototype)
+        self.instances.setdefault(key, []).append(nature)
+
+    def build(self):
+        for (cell, prototype), natures in self.instances.items():
+            name = f'instances_{natures[0].terrain_number}'
+            self.lod_batches.append(LODBatch(cell, name, prototype, natures, self.shaders))
+
+        self.camera_pos = None
+        self.update_lod(base.camera.get_pos(self.root))
+
+    def update_lod(self, camera_pos):
+        """Args:
+            camera_pos (Point3): the camera position relative to the root.
+        """
+        # Skip small moves of the camera, which delays switching bands by at most half the hysteresis.
+        if self.camera_pos is not None and (camera_pos - self.camera_pos).length() < self.hysteresis / 2:
+            return
+
+        self.camera_pos = Point3(camera_pos)
+        # Impostors face this position also while the shadow map is rendered.
+        self.root.set_shader_input('camera_pos', self.camera_pos)
+        pos = np.array(camera_pos, dtype=np.float32)
+        self.changed = sum(
+            lod_batch.update(pos, self.limits, self.hysteresis) for lod_batch in self.lod_batches)
+
+    def clear(self):
+        self.instances.clear()
+
+        for lod_batch in self.lod_batches:
+            lod_batch.remove()
+
+        self.lod_batches.clear()
+
+
 class Trees(NodePath):
 
-    def __init__(self, name, model, pos, scale):
+    obstacle = True
+    trunk_radius = 0.3
+    lod_cells = 12
+
+    def __init__(self, name, terrain_number, prototype, pos, scale):
         super().__init__(BulletRigidBodyNode(name))
-        model.reparent_to(self)
-        end, tip = model.get_tight_bounds()
-        height = (tip - end).z
-        shape = BulletCylinderShape(0.3, height, ZUp)
+        self.terrain_number = terrain_number
+        self.prototype = prototype
+
+        # Bullet applies the scale of a body to its shapes, so a shape is shared per scale.
+        key = (prototype.key, scale)
+        shape = prototypes.get(
+            key, lambda: BulletCylinderShape(self.trunk_radius, prototype.height, ZUp))
         self.node().add_shape(shape)
         self.set_collide_mask(Mask.environment)
+        self.keys = [prototype.key, key]
 
         self.setup_tree(pos, scale)
 
+    def reuse(self, terrain_number, pos):
+        self.set_name(self.get_name().removesuffix(f'_{self.terrain_number}') + f'_{terrain_number}')
+        self.terrain_number = terrain_number
+        self.setup_tree(pos, self.get_sx())
+
     def setup_tree(self, pos, scale):
         h = random.choice([n for n in range(0, 360, 20)])
         self.set_hpr(Vec3(h, 0, 0))
         self.set_pos(pos)
         self.set_scale(scale)
+        self.radius = self.trunk_radius * scale
+
+        # The radius of the trunk shape including its collision margin, which balls can hit.
+        self.collision_radius = self.radius + self.node().get_shape(0).get_margin()
+
+    def get_scaled_shape(self):
+        """Return the key and the shape with the scale of this tree applied,
+           which can be a child of a compound shape.
+        """
+        scale = self.get_sx()
+        key = (self.prototype.key, scale, 'scaled')
+        shape = prototypes.get(
+            key, lambda: BulletCylinderShape(self.trunk_radius * scale, self.prototype.height * scale, ZUp))
+        return key, shape
 
 
 class Fir(Trees):
 
     def __init__(self, terrain_number, pos, scale=1.0):
-        model = base.loader.loadModel('models/firtree/tree1.bam')
-        model.set_transform(TransformState.make_pos(Vec3(-0.25, -0.15, 0)))
+        prototype = Prototype.load('models/firtree/tree1.bam', Vec3(-0.25, -0.15, 0))
         name = f'fir_tree_{terrain_number}'
-        super().__init__(name, model, pos, scale)
+        super().__init__(name, terrain_number, prototype, pos, scale)
 
 
 class Pine(Trees):
 
     def __init__(self, terrain_number, pos, scale=1.0):
-        model = base.loader.loadModel('models/pinetree/tree2.bam')
-        model.set_transform(TransformState.make_pos(Vec3(-0.1, 0.12, 0)))
+        prototype = Prototype.load('models/pinetree/tree2.bam', Vec3(-0.1, 0.12, 0))
         name = f'pine_tree_{terrain_number}'
-        super().__init__(name, model, pos, scale)
+        super().__init__(name, terrain_number, prototype, pos, scale)
 
 
 class Palm(Trees):
 
     def __init__(self, terrain_number, pos, scale=1.5):
-        model = base.loader.loadModel('models/palmtree/tree3.bam')
-        model.set_transform(TransformState.make_pos(Vec3(-0.5, -0.03, 0)))
+        prototype = Prototype.load('models/palmtree/tree3.bam', Vec3(-0.5, -0.03, 0))
         name = f'palm_tree_{terrain_number}'
-        super().__init__(name, model, pos, scale)
+        super().__init__(name, terrain_number, prototype, pos, scale)
 
 
 class LeaflessTree(Trees):
 
     def __init__(self, terrain_number, pos, scale=0.5):
-        model = base.loader.loadModel('models/plant6/plants6')
-        model.set_transform(TransformState.make_pos(Vec3(0, 0, -10)))
+        prototype = Prototype.load('models/plant6/plants6', Vec3(0, 0, -10))
         name = f'leafless_tree_{terrain_number}'
-        super().__init__(name, model, pos, scale)
+        super().__init__(name, terrain_number, prototype, pos, scale)
 
 
 class Rock(NodePath):
 
+    obstacle = True
+
     def __init__(self, terrain_number, pos):
         super().__init__(BulletRigidBodyNode(f'rock_{terrain_number}'))
+        self.terrain_number = terrain_number
+        self.prototype = prototypes.get('rock', self.build_prototype)
+        self.prototype.model.instance_to(self)
+        self.set_collide_mask(Mask.environment)
+        self.keys = [self.prototype.key]
+
+        self.setup_rock(pos)
+
+    def reuse(self, terrain_number, pos):
+        self.set_name(f'rock_{terrain_number}')
+        self.terrain_number = terrain_number
+
+        # The scale is chosen again, so the shape shared per scale is replaced.
+        self.node().remove_shape(self.node().get_shape(0))
+        prototypes.release([self.keys.pop()])
+        self.clear_transform()
+        self.setup_rock(pos)
+
+    def build_prototype(self):
         model = Sphere(segments=8)
         tex = base.loader.load_texture('textures/rock_01.jpg')
         model.set_texture(tex)
-        model.reparent_to(self)
+        return Prototype('rock', model)
 
+    def build_shape(self):
         shape = BulletConvexHullShape()
-        shape.add_geom(model.node().get_geom(0))
-        self.node().add_shape(shape)
-        self.set_collide_mask(Mask.environment)
-
-        self.setup_rock(pos)
+        shape.add_geom(self.prototype.model.node().get_geom(0))
+        return shape
 
     def setup_rock(self, pos):
+        scale = Vec3(random.randint(1, 5), 3, random.randint(1, 5))  # Vec3(5, 3, 5)
+        key = ('rock', *scale)
+        shape = prototypes.get(key, self.build_shape)
+        self.node().add_shape(shape)
+        self.keys.append(key)
+
         hpr = Vec3(*random.sample([n for n in range(0, 360, 20)], 3))
         pos -= Vec3(0, 0, 3)
-        scale = Vec3(random.randint(1, 5), 3, random.randint(1, 5))  # Vec3(5, 3, 5)
         self.set_hpr(hpr)
         self.set_pos(pos)
         self.set_scale(scale)
 
+        # The horizontal footprint of the rotated and scaled sphere is an ellipse;
+        # use the mean of its semi-axes as the radius.
+        mat = self.get_mat()
+        linear = np.array([[mat.get_cell(i, j) for j in range(2)] for i in range(3)])
+        semi_axes = np.linalg.svd(linear, compute_uv=False)
+        self.radius = self.prototype.model.radius * semi_axes.mean()
+
+        # The longest semi-axis bounds the footprint, which balls must not pass through.
+        self.collision_radius = self.prototype.model.radius * semi_axes.max() + shape.get_margin()
+
+    def get_scaled_shape(self):
+        """Return the key and the shape with the scale of this rock applied,
+           which can be a child of a compound shape.
+        """
+        scale = self.get_scale()
+        key = ('rock', *scale, 'scaled')
+
+        def build():
+            shape = BulletConvexHullShape()
+            shape.add_geom(self.prototype.model.node().get_geom(0), TransformState.make_scale(scale))
+            return shape
+
+        return key, prototypes.get(key, build)
+
 
 class Flowers(NodePath):
 
-    def __init__(self, name, model, pos, scale):
+    obstacle = False
+    # Vertex clustering breaks small parts like petals, so the full model is used in the middle band.
+    lod_cells = 0
+
+    def __init__(self, name, terrain_number, prototype, pos, scale):
         super().__init__(PandaNode(name))
-        model.reparent_to(self)
+        self.terrain_number = terrain_number
+        self.prototype = prototype
+        self.radius = 0
+        self.keys = [prototype.key]
         self.setup_flower(pos, scale)
 
+    def reuse(self, terrain_number, pos):
+        self.set_name(self.get_name().removesuffix(f'_{self.terrain_number}') + f'_{terrain_number}')
+        self.terrain_number = terrain_number
+        self.setup_flower(pos, self.get_sx())
+
     def setup_flower(self, pos, scale):
         h = random.choice([n for n in range(0, 360, 20)])
         self.set_pos(pos)
@@ -132,22 +655,22 @@ class Flowers(NodePath):
 class Shrubbery(Flowers):
 
     def __init__(self, terrain_number, pos, scale=0.004):
-        model = base.loader.loadModel('models/shrubbery2/shrubbery2')
+        prototype = Prototype.load('models/shrubbery2/shrubbery2')
         name = f'shrubbery_{terrain_number}'
-        super().__init__(name, model, pos, scale)
+        super().__init__(name, terrain_number, prototype, pos, scale)
 
 
 class Grass(Flowers):
 
     def __init__(self, terrain_number, pos, scale=0.05):
-        model = base.loader.loadModel('models/shrubbery/shrubbery')
+        prototype = Prototype.load('models/shrubbery/shrubbery')
         name = f'grass_{terrain_number}'
-        super().__init__(name, model, pos, scale)
+        super().__init__(name, terrain_number, prototype, pos, scale)
 
 
 class RedFlower(Flowers):
 
     def __init__(self, terrain_number, pos, scale=3):
-        model = base.loader.loadModel('models/tulip/Tulip')
+        prototype = Prototype.load('models/tulip/Tulip')
         name = f'tulip_{terrain_number}'
-        super().__init__(name, model, pos, scale)
\ No newline at end of file
+        super().__init__(name, terrain_number, prototype, pos, scale)
\ No newline at end of file
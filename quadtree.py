@@ -0,0 +1,84 @@
+import math
+
+from panda3d.core import NodePath, PandaNode
+
+
+class Quadtree(NodePath):
+    """A quadtree of nodes covering a square tile. Objects are attached to the leaf
+       containing them, and Panda3D computes the bounds of each cell from its children,
+       so a cell outside the view frustum is culled with all of its objects at once.
+       Cells are created only when an object is added to them.
+        Args:
+            name (str): the name of the root node;
+            center (Vec2): the center of the tile;
+            size (float): the size of the tile;
+            leaf_size (float): the upper limit of the size of leaf cells;
+    """
+
+    def __init__(self, name, center, size, leaf_size):
+        super().__init__(PandaNode(name))
+        self.left = center.x - size / 2
+        self.bottom = center.y - size / 2
+        self.depth = max(math.ceil(math.log2(size / leaf_size)), 0)
+        self.divisions = 2 ** self.depth
+        self.leaf_size = size / self.divisions
+        self.cells = {}
+        self.counts = {}
+
+    def get_index(self, x, y):
+        i = math.floor((x - self.left) / self.leaf_size)
+        j = math.floor((y - self.bottom) / self.leaf_size)
+        return min(max(i, 0), self.divisions - 1), min(max(j, 0), self.divisions - 1)
+
+    def get_cell(self, level, i, j):
+        """Return the node of a cell, creating it and its ancestors if necessary.
+            Args:
+                level (int): the depth of the cell; 0 is the root;
+                i, j (int): the column and row of the cell in the level;
+        """
+        if level == 0:
+            return self
+
+        if (cell := self.cells.get((level, i, j))) is None:
+            parent = self.get_cell(level - 1, i // 2, j // 2)
+            cell = parent.attach_new_node(f'cell_{level}_{i}_{j}')
+            self.cells[(level, i, j)] = cell
+
+        return cell
+
+    def get_leaf(self, x, y):
+        """Return the leaf node containing a point.
+            Args:
+                x, y (float): the point.
+        """
+        return self.get_cell(self.depth, *self.get_index(x, y))
+
+    def add(self, nodepath):
+        """Attach a node to the leaf containing its position."""
+        pos = nodepath.get_pos()
+        nodepath.reparent_to(self.get_leaf(pos.x, pos.y))
+
+    def count(self, x, y, n=1):
+        """Count objects in the leaf containing a point.
+            Args:
+                x, y (float): the point;
+                n (int): the number of objects;
+        """
+        index = self.get_index(x, y)
+        self.counts[index] = self.counts.get(index, 0) + n
+
+    def get_leaves(self):
+        if self.depth == 0:
+            yield (0, 0), self
+            return
+
+        for (level, i, j), cell in self.cells.items():
+            if level == self.depth:
+                yield (i, j), cell
+
+    def clear(self):
+        for cell in self.get_children():
+            cell.remove_node()
+
+        self.cells.clear()
+        self.counts.clear()
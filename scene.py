@@ -45,6 +45,8 @@ class Scene(NodePath):
 
         self.terrains = Terrains(self.world)
         self.terrains.reparent_to(self)
+        self.directional_light.set_casters(
+            self.terrains, self.terrains.terrains, self.terrains.natures, self.sky)
 
         self.goal_gate = GoalGate(self.world)
         self.goal_gate.reparent_to(self)
@@ -52,7 +54,8 @@ class Scene(NodePath):
     def setup_scene(self):
         pos, angle = self.decide_goal_pos()
         self.goal_gate.setup_gate(pos, angle)
-        self.terrains.setup_nature()
+        self.terrains.setup_nature(self.goal_gate.foundation, self.goal_gate.poles)
+        self.directional_light.render_static(base.camera.get_pos(base.render))
         base.taskMgr.add(self.goal_gate.sensor.check_finish, 'check_finish')
 
     def cleanup_scene(self):
@@ -68,7 +71,7 @@ class Scene(NodePath):
         ]
 
         pt, angle = random.choice(candidates)
-        pos = self.terrains.check_position(*pt, sweep=False)
+        pos = self.terrains.sampler.get_pos(*pt)
         return pos, angle
 
     def update(self):
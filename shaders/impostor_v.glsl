@@ -0,0 +1,40 @@
+#version 300 es
+precision highp float;
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+
+// The camera position relative to the batches.
+uniform vec3 camera_pos;
+
+// Two texels per instance: (x, y, z, scale) and (cos(h), sin(h), 0, 0).
+uniform sampler2D instance_data;
+
+in vec4 p3d_Vertex;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec4 color;
+out vec3 normal;
+out vec4 view_pos;
+
+void main() {
+    vec4 pos_scale = texelFetch(instance_data, ivec2(0, gl_InstanceID), 0);
+
+    // Turn the card around the z axis so that its front faces the camera.
+    vec2 dir = camera_pos.xy - pos_scale.xy;
+    dir = length(dir) > 0.0 ? normalize(dir) : vec2(0.0, -1.0);
+    mat2 rot = mat2(-dir.y, dir.x, -dir.x, -dir.y);
+
+    vec4 vertex = p3d_Vertex;
+    vertex.xy = rot * vertex.xy;
+    vertex.xyz = vertex.xyz * pos_scale.w + pos_scale.xyz;
+
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+    view_pos = p3d_ModelViewMatrix * vertex;
+    // The baked image has no normals; light the card like the top of a crown.
+    normal = normalize(p3d_NormalMatrix * vec3(0.0, 0.0, 1.0));
+    texcoord = p3d_MultiTexCoord0;
+    color = p3d_Color;
+}
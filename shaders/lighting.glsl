@@ -0,0 +1,33 @@
+precision highp sampler2DShadow;
+
+uniform struct p3d_LightModelParameters {
+    vec4 ambient;
+} p3d_LightModel;
+
+uniform struct p3d_LightSourceParameters {
+    vec4 color;
+    vec4 position;
+    sampler2DShadow shadowMap;
+    mat4 shadowViewMatrix;
+} p3d_LightSource[1];
+
+// The shadow map of the terrains and natures, rendered only when they change.
+// The shadow map of the light itself holds only the moving objects.
+uniform sampler2DShadow static_shadow_map;
+uniform mat4 static_shadow_matrix;
+
+float get_shadow(vec4 view_pos) {
+    return min(
+        textureProj(p3d_LightSource[0].shadowMap, p3d_LightSource[0].shadowViewMatrix * view_pos),
+        textureProj(static_shadow_map, static_shadow_matrix * view_pos)
+    );
+}
+
+float get_diffuse(vec3 normal) {
+    return max(dot(normalize(normal), normalize(p3d_LightSource[0].position.xyz)), 0.0);
+}
+
+vec3 get_light(vec4 view_pos, vec3 normal) {
+    return p3d_LightModel.ambient.rgb
+        + p3d_LightSource[0].color.rgb * get_diffuse(normal) * get_shadow(view_pos);
+}
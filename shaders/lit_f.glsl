@@ -0,0 +1,22 @@
+#version 300 es
+precision highp float;
+
+uniform sampler2D p3d_Texture0;
+uniform vec4 p3d_ColorScale;
+
+#pragma include "lighting.glsl"
+
+in vec2 texcoord;
+in vec4 color;
+in vec3 normal;
+in vec4 view_pos;
+
+out vec4 fragColor;
+
+void main() {
+    vec4 albedo = texture(p3d_Texture0, texcoord) * color * p3d_ColorScale;
+
+    // The banner is two sided.
+    vec3 n = gl_FrontFacing ? normal : -normal;
+    fragColor = vec4(albedo.rgb * get_light(view_pos, n), albedo.a);
+}
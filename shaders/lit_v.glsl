@@ -0,0 +1,24 @@
+#version 300 es
+precision highp float;
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform mat4 p3d_TextureMatrix[1];
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec4 color;
+out vec3 normal;
+out vec4 view_pos;
+
+void main() {
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    view_pos = p3d_ModelViewMatrix * p3d_Vertex;
+    normal = normalize(p3d_NormalMatrix * p3d_Normal);
+    texcoord = (p3d_TextureMatrix[0] * vec4(p3d_MultiTexCoord0, 0.0, 1.0)).xy;
+    color = p3d_Color;
+}
@@ -0,0 +1,37 @@
+#version 300 es
+precision highp float;
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+
+// Two texels per instance: (x, y, z, scale) and (cos(h), sin(h), 0, 0).
+uniform sampler2D instance_data;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec4 p3d_Color;
+in vec2 p3d_MultiTexCoord0;
+
+out vec2 texcoord;
+out vec4 color;
+out vec3 normal;
+out vec4 view_pos;
+
+void main() {
+    vec4 pos_scale = texelFetch(instance_data, ivec2(0, gl_InstanceID), 0);
+    vec4 heading = texelFetch(instance_data, ivec2(1, gl_InstanceID), 0);
+    mat2 rot = mat2(heading.x, heading.y, -heading.y, heading.x);
+
+    vec4 vertex = p3d_Vertex;
+    vertex.xy = rot * vertex.xy;
+    vertex.xyz = vertex.xyz * pos_scale.w + pos_scale.xyz;
+
+    vec3 n = p3d_Normal;
+    n.xy = rot * n.xy;
+
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+    view_pos = p3d_ModelViewMatrix * vertex;
+    normal = normalize(p3d_NormalMatrix * n);
+    texcoord = p3d_MultiTexCoord0;
+    color = p3d_Color;
+}
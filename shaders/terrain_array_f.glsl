@@ -0,0 +1,29 @@
+#version 300 es
+precision highp float;
+precision highp sampler2DArray;
+
+uniform vec4 tex_scales;
+uniform sampler2D splat_map;
+uniform sampler2DArray layers;
+
+#pragma include "lighting.glsl"
+
+in vec2 texcoord0;
+in vec3 normal;
+in vec4 view_pos;
+out vec4 fragColor;
+
+void main() {
+    // The splat map has one texel per heightfield pixel.
+    vec2 size = vec2(textureSize(splat_map, 0));
+    vec4 w = texture(splat_map, (texcoord0 * (size - 1.0) + 0.5) / size);
+
+    fragColor = texture(layers, vec3(texcoord0 * tex_scales.x, 0.0)) * w.r
+              + texture(layers, vec3(texcoord0 * tex_scales.y, 1.0)) * w.g
+              + texture(layers, vec3(texcoord0 * tex_scales.z, 2.0)) * w.b
+              + texture(layers, vec3(texcoord0 * tex_scales.w, 3.0)) * w.a;
+
+    // The terrain is drawn unlit, so only the light blocked by shadows is taken away.
+    vec3 lit = p3d_LightModel.ambient.rgb + p3d_LightSource[0].color.rgb * get_diffuse(normal);
+    fragColor.rgb *= get_light(view_pos, normal) / lit;
+}
@@ -11,12 +11,16 @@ uniform sampler2D p3d_Texture1;
 uniform sampler2D p3d_Texture2;
 uniform sampler2D p3d_Texture3;
 
+#pragma include "lighting.glsl"
+
 in vec2 texcoord0;
 in vec2 texcoord1;
 in vec2 texcoord2;
 in vec2 texcoord3;
 
 in vec4 vertex;
+in vec3 normal;
+in vec4 view_pos;
 out vec4 fragColor;
 
 float computeWeight(float min_z, float max_z, vec4 vertex){
@@ -55,5 +59,9 @@ void main() {
     float w3 = computeWeight(min_z, max_z, vertex);
 
     fragColor = tex0 * w0 + tex1 * w1 + tex2 * w2 + tex3 * w3;
+
+    // The terrain is drawn unlit, so only the light blocked by shadows is taken away.
+    vec3 lit = p3d_LightModel.ambient.rgb + p3d_LightSource[0].color.rgb * get_diffuse(normal);
+    fragColor.rgb *= get_light(view_pos, normal) / lit;
 }
 
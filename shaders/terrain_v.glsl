@@ -1,6 +1,8 @@
 #version 300 es
 precision highp float;
 uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
 
 in vec4 p3d_Vertex;
 in vec4 p3d_Normal;
@@ -15,6 +17,8 @@ out vec2 texcoord2;
 out vec2 texcoord3;
 
 out vec4 vertex;
+out vec3 normal;
+out vec4 view_pos;
 
 void main() {
     gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
@@ -23,6 +27,8 @@ void main() {
     texcoord2 = p3d_MultiTexCoord2;
     texcoord3 = p3d_MultiTexCoord3;
     vertex = p3d_Vertex;
+    normal = normalize(p3d_NormalMatrix * p3d_Normal.xyz);
+    view_pos = p3d_ModelViewMatrix * p3d_Vertex;
 }
 
 
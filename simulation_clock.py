@@ -0,0 +1,72 @@
+from constants import SimulationConfig
+
+
+class SimulationClock:
+    """Advance the simulation by a fixed step whatever the frame rate is. The frame time
+       is accumulated, and as many steps as it covers are run, up to max_substeps per frame;
+       the time of the steps beyond that is dropped, so that a long frame slows the game down
+       instead of making one giant step. Rendered transforms are interpolated between the last
+       two states by the time left over.
+        Args:
+            rate (int): the number of steps per second;
+            max_substeps (int): the upper limit of steps per frame;
+    """
+
+    def __init__(self, rate=SimulationConfig.rate, max_substeps=SimulationConfig.max_substeps):
+        self.step = 1 / rate
+        self.max_substeps = max_substeps
+        self.targets = []
+        self.accumulator = 0
+
+        self.substeps = 0
+        self.dropped = 0
+        self.frames = 0
+        self.total_substeps = 0
+        self.total_dropped = 0
+
+    @property
+    def stats(self):
+        return dict(
+            substeps=self.substeps,
+            dropped=self.dropped,
+            total_substeps=self.total_substeps,
+            total_dropped=self.total_dropped,
+            substeps_per_frame=self.total_substeps / self.frames if self.frames else 0
+        )
+
+    @property
+    def alpha(self):
+        return self.accumulator / self.step
+
+    def add(self, target):
+        """Args:
+            target: an object whose transforms are interpolated, which has restore() to put back
+                    the latest state before stepping, and interpolate(alpha) to blend the last two states;
+        """
+        self.targets.append(target)
+
+    def tick(self, dt):
+        """Put back the latest states of the targets and return the number of steps to run in this frame.
+            Args:
+                dt (float): the time elapsed since the last frame;
+        """
+        for target in self.targets:
+            target.restore()
+
+        self.accumulator += dt
+        # The tolerance keeps a frame of exactly one step from running no step by rounding.
+        n = int(self.accumulator / self.step + 1e-6)
+        self.substeps = min(n, self.max_substeps)
+        self.dropped = n - self.substeps
+        self.accumulator -= n * self.step
+
+        self.frames += 1
+        self.total_substeps += self.substeps
+        self.total_dropped += self.dropped
+        return self.substeps
+
+    def interpolate(self):
+        alpha = self.alpha
+
+        for target in self.targets:
+            target.interpolate(alpha)
@@ -1,19 +1,24 @@
-import pathlib
-import random
+import time
 from enum import Enum
 
-from panda3d.bullet import BulletRigidBodyNode
-from panda3d.bullet import BulletSphereShape, BulletHeightfieldShape, ZUp
+import numpy as np
+from panda3d.bullet import BulletRigidBodyNode, BulletClosestHitRayResult
+from panda3d.bullet import BulletHeightfieldShape, ZUp
 from panda3d.core import NodePath, PandaNode
 from panda3d.core import Vec3, Point3, Vec2
-from panda3d.core import Filename, PNMImage
+from panda3d.core import TransformState
 from panda3d.core import Shader
-from panda3d.core import TextureStage, TransformState
+from panda3d.core import TextureStage, Texture, PNMImage, SamplerState
 from panda3d.core import GeoMipTerrain
 
-from constants import Mask
+from constants import Mask, SplatConfig
 from heightmap import Areas, HeightMap
+from height_pyramid import HeightPyramid
+from height_sampler import HeightSampler
+from nature_placer import NaturePlacer
+from quadtree import Quadtree
 from natures import WaterSurface, Rock, Shrubbery, Grass, Fir, Pine
+from natures import Trees, Flowers, InstancedVegetation, NaturePool, prototypes
 
 
 class TerrainImages(Enum):
@@ -27,6 +32,14 @@ class TerrainImages(Enum):
     def path(self):
         return f'textures/{self.file}'
 
+    @classmethod
+    def get_texture_set(cls, name):
+        for texture_set in cls.__subclasses__():
+            if texture_set.__name__ == name:
+                return texture_set
+
+        raise ValueError(f'Unknown texture set: {name}')
+
 
 class Green(TerrainImages):
 
@@ -60,24 +73,341 @@ class LightGreen(TerrainImages):
     TEX3 = ('grass_05.jpg', 10)
 
 
-class Natures(NodePath):
+def select_texture_set(ratio):
+    """Return the texture set suitable for a heightmap.
+        Args:
+            ratio (tuple): white and black ratio of the binarized heightmap.
+    """
+    match ratio:
+        case _, black if black >= 0.8:
+            return Sand
+        case _, black if black >= 0.6:
+            return Stones
+        case _, black if black >= 0.5:
+            return LightGreen
+        case _:
+            return Green
+
+
+class TerrainMaterials:
+    """Cache the terrain shader, TextureStages and textures, and keep each texture set
+       as one RenderState, so that a texture set is swapped on all the tiles by replacing
+       the state of their parent node.
+       In texture array mode, the four images are put into one sampler2DArray, and the weights
+       of the height bands are baked into a splat map of each tile instead of computed per fragment.
+        Args:
+            preload (bool): if True, the states of all the texture sets are built at first;
+            texture_array (bool): if True, use a texture array and splat maps;
+            layer_size (int): the size of the layers of a texture array;
+    """
+
+    def __init__(self, preload=False, texture_array=False, layer_size=512):
+        frag = 'shaders/terrain_array_f.glsl' if texture_array else 'shaders/terrain_f.glsl'
+        self.shader = Shader.load(Shader.SL_GLSL, 'shaders/terrain_v.glsl', frag)
+        self.texture_array = texture_array
+        self.layer_size = layer_size
+        self.bands = np.array(SplatConfig.bands, dtype=np.float32) / SplatConfig.scale
+        self.stages = []
+        self.states = {}
+        self.splat_maps = {}
+        self.built = 0
+        self.swapped = 0
+        self.baked = 0
+
+        for i in range(4):
+            ts = TextureStage(f'ts{i}')
+            ts.set_sort(i)
+            self.stages.append(ts)
+
+        if preload:
+            for texture_set in TerrainImages.__subclasses__():
+                self.get_state(texture_set)
 
-    def __init__(self, name, world):
+    @property
+    def stats(self):
+        return dict(
+            states=len(self.states),
+            built=self.built,
+            swapped=self.swapped,
+            baked=self.baked
+        )
+
+    def get_state(self, texture_set):
+        """Return the RenderState of a texture set, building it if necessary.
+            Args:
+                texture_set (TerrainImages): the subclass of TerrainImages.
+        """
+        if (state := self.states.get(texture_set)) is None:
+            material = NodePath('material')
+            material.set_shader(self.shader)
+
+            if self.texture_array:
+                material.set_shader_input('layers', self.make_texture_array(texture_set))
+                material.set_shader_input('tex_scales', tuple(img.tex_scale for img in texture_set))
+            else:
+                for ts, img in zip(self.stages, texture_set):
+                    material.set_shader_input(f'tex_ScaleFactor{ts.get_sort()}', img.tex_scale)
+                    material.set_texture(ts, base.loader.load_texture(img.path))
+
+            state = material.get_state()
+            self.states[texture_set] = state
+            self.built += 1
+
+        return state
+
+    def apply(self, nodepath, texture_set):
+        """Replace the state of a node with that of a texture set.
+            Args:
+                nodepath (NodePath): the parent node of the terrains;
+                texture_set (TerrainImages): the subclass of TerrainImages;
+        """
+        nodepath.set_state(self.get_state(texture_set))
+        self.swapped += 1
+
+    def make_texture_array(self, texture_set):
+        size = self.layer_size
+        tex = Texture(f'layers_{texture_set.__name__}')
+        tex.setup_2d_texture_array(size, size, len(texture_set), Texture.T_unsigned_byte, Texture.F_rgba)
+
+        for z, img in enumerate(texture_set):
+            src = PNMImage(img.path)
+            if not src.has_alpha():
+                src.add_alpha()
+                src.alpha_fill(1)
+
+            layer = PNMImage(size, size, 4)
+            layer.gaussian_filter_from(1.0, src)
+            tex.load(layer, z, 0)
+
+        tex.set_minfilter(SamplerState.FT_linear_mipmap_linear)
+        tex.set_magfilter(SamplerState.FT_linear)
+        return tex
+
+    def bake_splat_map(self, tile):
+        """Return the splat map of a tile, whose RGBA channels are the weights
+           of the four height bands at each pixel of the heightfield.
+            Args:
+                tile (Tile): the tile of the heightmap.
+        """
+        z = tile.img.astype(np.float32)[::-1, :, None] / 65535
+        min_z, max_z = self.bands[:, 0], self.bands[:, 1]
+        region = max_z - min_z
+        weights = np.maximum(0, (region - np.abs(z - max_z)) / region)
+        # The channels of a ram image are in BGRA order.
+        img = np.round(weights[..., [2, 1, 0, 3]] * 255).astype(np.uint8)
+
+        if (tex := self.splat_maps.get(tile.name)) is None:
+            tex = Texture(f'splat_{tile.name}')
+            tex.set_wrap_u(SamplerState.WM_clamp)
+            tex.set_wrap_v(SamplerState.WM_clamp)
+            tex.set_minfilter(SamplerState.FT_linear)
+            tex.set_magfilter(SamplerState.FT_linear)
+            self.splat_maps[tile.name] = tex
+
+        h, w = tile.img.shape
+        tex.setup_2d_texture(w, h, Texture.T_unsigned_byte, Texture.F_rgba)
+        tex.set_ram_image(np.ascontiguousarray(img))
+        self.baked += 1
+        return tex
+
+
+class NatureCompound(NodePath):
+    """A static rigid body holding the collision shapes of all the rocks and trees
+       on a tile as the children of one compound shape. The nature types of the children
+       are kept in the same order as the child shapes.
+        Args:
+            terrain_number (int): the number of the tile.
+    """
+
+    def __init__(self, terrain_number):
+        super().__init__(BulletRigidBodyNode(f'natures_{terrain_number}'))
+        self.set_collide_mask(Mask.environment)
+        self.nature_types = []
+        self.keys = []
+
+    def add(self, nature):
+        key, shape = nature.get_scaled_shape()
+        ts = TransformState.make_pos_hpr(nature.get_pos(), nature.get_hpr())
+        self.node().add_shape(shape, ts)
+        self.nature_types.append(type(nature))
+        self.keys.append(key)
+
+    def get_nature_type(self, index):
+        """Return the nature type of a child shape, or None if the index is out of range.
+            Args:
+                index (int): the index of the child shape, which a ray test returns as the triangle index.
+        """
+        if 0 <= index < len(self.nature_types):
+            return self.nature_types[index]
+
+        return None
+
+
+class Natures(NodePath):
+    """Natures on each tile are attached to the leaves of a quadtree,
+       so that view frustum culling tests cells instead of each nature.
+        Args:
+            name (str): the name of the node;
+            world (BulletWorld): the world where natures are attached;
+            tiles (list): the tiles of the heightmap;
+            compound (bool): if True, merge the shapes of rocks and trees on a tile into one compound body;
+            cell_size (float): the upper limit of the size of the leaves of quadtrees;
+    """
+
+    def __init__(self, name, world, tiles, compound=False, cell_size=32):
         super().__init__(PandaNode(name))
         self.world = world
+        self.compound = compound
+        self.vegetation = InstancedVegetation(self)
+        self.natures = []
+        self.compounds = {}
+        self.pool = NaturePool()
+        self.quadtrees = {}
+
+        for tile in tiles:
+            quadtree = Quadtree(f'tile_{tile.quadrant}', tile.center, tile.size, cell_size)
+            quadtree.reparent_to(self)
+            self.quadtrees[tile.quadrant] = quadtree
 
     def add_to_terrain(self, nature):
-        nature.reparent_to(self)
-
-        if isinstance(nd := nature.node(), BulletRigidBodyNode):
-            self.world.attach(nd)
+        self.natures.append(nature)
+
+        # A water surface covers a whole tile.
+        if isinstance(nature, WaterSurface):
+            nature.reparent_to(self)
+            return
+
+        quadtree = self.quadtrees[nature.terrain_number]
+        pos = nature.get_pos()
+        quadtree.count(pos.x, pos.y)
+
+        if isinstance(nature, Trees | Flowers):
+            self.vegetation.add(nature, quadtree.get_leaf(pos.x, pos.y))
+
+        # Flowers are drawn only by the instances and have nothing to collide.
+        if isinstance(nature, Flowers):
+            return
+
+        if self.compound and isinstance(nature, Trees | Rock):
+            if (compound := self.compounds.get(nature.terrain_number)) is None:
+                compound = NatureCompound(nature.terrain_number)
+                self.compounds[nature.terrain_number] = compound
+
+            compound.add(nature)
+
+            # Trees are drawn only by the instances.
+            if isinstance(nature, Rock):
+                quadtree.add(nature)
+            return
+
+        quadtree.add(nature)
+        self.world.attach(nature.node())
+
+    def build(self):
+        self.vegetation.build()
+
+        for compound in self.compounds.values():
+            compound.reparent_to(self)
+            self.world.attach(compound.node())
+
+    def update_lod(self):
+        self.vegetation.update_lod(base.camera.get_pos(self))
+
+    def get_cell_counts(self):
+        """Return the number of natures in each leaf, keyed by (terrain number, column, row)."""
+        return {
+            (n, *index): count for n, quadtree in self.quadtrees.items() for index, count in quadtree.counts.items()
+        }
+
+    def get_cull_stats(self, camera=None):
+        """Return the numbers of leaves, natures and GeomNodes inside
+           and outside the view frustum of a camera.
+            Args:
+                camera (NodePath): the camera; base.cam by default.
+        """
+        camera = camera or base.cam
+        frustum = camera.node().get_lens().make_bounds()
+        frustum.xform(camera.get_mat(self))
+        stats = dict(visible=0, culled=0, visible_natures=0, culled_natures=0, geom_nodes=0)
+
+        for quadtree in self.quadtrees.values():
+            for index, leaf in quadtree.get_leaves():
+                count = quadtree.counts.get(index, 0)
+
+                if frustum.contains(leaf.get_bounds()):
+                    stats['visible'] += 1
+                    stats['visible_natures'] += count
+                    stats['geom_nodes'] += leaf.find_all_matches('**/+GeomNode').get_num_paths()
+                else:
+                    stats['culled'] += 1
+                    stats['culled_natures'] += count
+
+        return stats
+
+    def get_nature_type(self, result):
+        """Return the nature type hit by a ray or sweep test, or None if no nature was hit.
+            Args:
+                result (BulletClosestHitRayResult or BulletClosestHitSweepResult): the result of a test.
+        """
+        if not result.has_hit():
+            return None
+
+        node = result.get_node()
+
+        for compound in self.compounds.values():
+            if compound.node() == node:
+                return compound.get_nature_type(self.get_shape_index(node, result))
+
+        for nature in self.natures:
+            if nature.node() == node:
+                return type(nature)
+
+        return None
+
+    def get_shape_index(self, node, result, depth=0.5):
+        """Return the index of the child shape of a compound body hit by a ray or sweep test.
+           Sweep results do not have the index, so a short ray is cast into the body at the hit position.
+            Args:
+                node (BulletRigidBodyNode): the compound body;
+                result (BulletClosestHitRayResult or BulletClosestHitSweepResult): the result of a test;
+                depth (float): the distance which the ray goes on each side of the surface;
+        """
+        if isinstance(result, BulletClosestHitRayResult):
+            return result.get_triangle_index()
+
+        pos = result.get_hit_pos()
+        normal = result.get_hit_normal()
+        hits = self.world.ray_test_all(pos + normal * depth, pos - normal * depth, Mask.environment)
+        hits = [hit for hit in hits.get_hits() if hit.get_node() == node]
+
+        if not hits:
+            return -1
+
+        return min(hits, key=lambda hit: hit.get_hit_fraction()).get_triangle_index()
 
     def remove_from_terrain(self):
-        for np in self.get_children():
-            if isinstance(nd := np.node(), BulletRigidBodyNode):
+        self.vegetation.clear()
+
+        for compound in self.compounds.values():
+            self.world.remove(compound.node())
+            prototypes.release(compound.keys)
+            compound.remove_node()
+
+        self.compounds.clear()
+
+        for nature in self.natures:
+            if isinstance(nd := nature.node(), BulletRigidBodyNode) and not self.compound:
                 self.world.remove(nd)
 
-            np.remove_node()
+            if isinstance(nature, WaterSurface):
+                nature.remove_node()
+            else:
+                self.pool.put(nature)
+
+        self.natures.clear()
+
+        for quadtree in self.quadtrees.values():
+            quadtree.clear()
 
 
 class BulletTerrain(NodePath):
@@ -93,8 +423,7 @@ class BulletTerrain(NodePath):
         self.add_terrain_shape()
 
     def add_terrain_shape(self):
-        img = PNMImage(Filename(self.tile.file))
-        shape = BulletHeightfieldShape(img, self.height, ZUp)
+        shape = BulletHeightfieldShape(self.tile.pnm, self.height, ZUp)
         shape.set_use_diamond_subdivision(True)
         self.node().add_shape(shape)
 
@@ -105,13 +434,31 @@ class BulletTerrain(NodePath):
     def replace_heightfield(self):
         self.remove_terrain_shape()
         self.add_terrain_shape()
-        self.terrain.set_heightfield(self.tile.file)
-        self.terrain.generate()
+        self.terrain.set_heightfield(self.tile.pnm)
+        self.generate()
 
-    def make_geomip_terrain(self, texture_set):
-        name = pathlib.Path(self.tile.file).stem
-        self.terrain = GeoMipTerrain(f'terrain_{name}')
-        self.terrain.set_heightfield(self.tile.file)
+    def generate(self):
+        self.terrain.generate()
+        self.blocks = self.root.find_all_matches('+GeomNode')
+        self.focal_pos = base.camera.get_pos(base.render)
+
+    def update_lod(self):
+        """Re-tessellate the blocks whose levels have changed with the camera position.
+           Returns the number of changed blocks and the time taken by GeoMipTerrain.update in ms.
+        """
+        # A changed block gets a new Geom.
+        geoms = [block.node().get_geom(0).this for block in self.blocks]
+        start = time.perf_counter()
+        self.terrain.update()
+        elapsed = (time.perf_counter() - start) * 1000
+        changed = sum(geom != block.node().get_geom(0).this for geom, block in zip(geoms, self.blocks))
+
+        self.focal_pos = base.camera.get_pos(base.render)
+        return changed, elapsed
+
+    def make_geomip_terrain(self):
+        self.terrain = GeoMipTerrain(f'terrain_{self.tile.name}')
+        self.terrain.set_heightfield(self.tile.pnm)
         self.terrain.set_border_stitching(True)
         # terrain.clear_color_map()
         # block_size 8 and min 2, or block_size 16 and min 3 is good.
@@ -123,75 +470,128 @@ class BulletTerrain(NodePath):
         self.root = self.terrain.get_root()
         self.root.set_scale(Vec3(1, 1, self.height))
         self.root.set_pos(pos)
-        self.terrain.generate()
+        self.generate()
         self.root.reparent_to(self)
 
-        shader = Shader.load(Shader.SL_GLSL, 'shaders/terrain_v.glsl', 'shaders/terrain_f.glsl')
-        self.root.set_shader(shader)
-        self.texture_to_terrain(texture_set)
-
-    def texture_to_terrain(self, tex_imgs):
-        self.root.clear_texture()
-
-        for i, img in enumerate(tex_imgs):
-            ts = TextureStage(f'ts{i}')
-            ts.set_sort(i)
-            self.root.set_shader_input(f'tex_ScaleFactor{i}', img.tex_scale)
-            tex = base.loader.load_texture(img.path)
-            self.root.set_texture(ts, tex)
-
 
 class Terrains(NodePath):
-
-    def __init__(self, world):
+    """Args:
+        world (BulletWorld): the world where terrains and natures are attached;
+        compound_natures (bool): if True, the shapes of rocks and trees on a tile are merged into one body;
+        lod_distance (float): the distance the camera must move before a tile is re-tessellated;
+        preload_materials (bool): if True, the states of all the texture sets are built at startup;
+        texture_array (bool): if True, terrains are textured with a texture array and splat maps;
+    """
+
+    def __init__(self, world, compound_natures=False, lod_distance=8, preload_materials=False,
+                 texture_array=False):
         super().__init__(PandaNode('terrain_root'))
         self.world = world
         self.height = 30
+        self.lod_distance = lod_distance
+        self.lod_index = 0
+
+        self.lod_updates = 0
+        self.blocks_changed = 0
+        self.last_blocks_changed = 0
+        self.last_update_ms = 0
+        self.max_update_ms = 0
 
         self.terrains = NodePath('terrains')
         self.terrains.reparent_to(self)
+        self.materials = TerrainMaterials(preload_materials, texture_array)
 
-        self.natures = Natures('natures', self.world)
+        self.heightmap = HeightMap()
+        self.natures = Natures('natures', self.world, self.heightmap.tiles, compound_natures)
         self.natures.reparent_to(self)
 
-        self.test_shape = BulletSphereShape(4)
-        self.heightmap = HeightMap()
+        self.placer = NaturePlacer(test_radius=4)
+        self.sampler = HeightSampler(self.height)
+        self.pyramid = HeightPyramid(self.sampler)
         self.bullet_terrains = []
 
+    @property
+    def lod_stats(self):
+        return dict(
+            updates=self.lod_updates,
+            blocks_changed=self.blocks_changed,
+            last_blocks_changed=self.last_blocks_changed,
+            last_update_ms=self.last_update_ms,
+            max_update_ms=self.max_update_ms
+        )
+
     def create_heightmap(self):
         self.heightmap.create()
-        ratio = self.heightmap.binarize()
+        self.sampler.set_heightmap(self.heightmap.img)
+        self.pyramid.build()
 
-        match ratio:
-            case _, black if black >= 0.8:
-                return Sand
-            case _, black if black >= 0.6:
-                return Stones
-            case _, black if black >= 0.5:
-                return LightGreen
-            case _:
-                return Green
+        if name := self.heightmap.data.texture_set:
+            return TerrainImages.get_texture_set(name)
+
+        ratio = self.heightmap.binarize()
+        return select_texture_set(ratio)
 
     def replace_terrain(self, texture_set=None):
-        tex_imgs = self.create_heightmap()
+        texture_set = self.create_heightmap()
+        self.materials.apply(self.terrains, texture_set)
 
         for bullet_terrain in self.bullet_terrains:
             bullet_terrain.replace_heightfield()
-            bullet_terrain.texture_to_terrain(tex_imgs)
+            self.apply_splat_map(bullet_terrain)
 
     def initialize(self, texture_set=Green):
-        tex_imgs = self.create_heightmap()
+        texture_set = self.create_heightmap()
+        self.materials.apply(self.terrains, texture_set)
 
         for tile in self.heightmap.tiles:
             bullet_terrain = BulletTerrain(tile, self.height, tile.quadrant)
-            bullet_terrain.make_geomip_terrain(tex_imgs)
+            bullet_terrain.make_geomip_terrain()
+            self.apply_splat_map(bullet_terrain)
             bullet_terrain.reparent_to(self.terrains)
             self.world.attach(bullet_terrain.node())
             self.bullet_terrains.append(bullet_terrain)
 
-    def setup_nature(self):
+        base.taskMgr.add(self.update_lod, 'update_terrain_lod')
+
+    def apply_splat_map(self, bullet_terrain):
+        if self.materials.texture_array:
+            splat_map = self.materials.bake_splat_map(bullet_terrain.tile)
+            bullet_terrain.root.set_shader_input('splat_map', splat_map)
+
+    def update_lod(self, task):
+        """Re-tessellate at most one tile per frame, going round the tiles,
+           and only if the camera has moved by lod_distance since the tile was last updated.
+        """
+        camera_pos = base.camera.get_pos(base.render)
+
+        for _ in range(len(self.bullet_terrains)):
+            bullet_terrain = self.bullet_terrains[self.lod_index]
+            self.lod_index = (self.lod_index + 1) % len(self.bullet_terrains)
+
+            if (camera_pos - bullet_terrain.focal_pos).length() >= self.lod_distance:
+                changed, elapsed = bullet_terrain.update_lod()
+                self.lod_updates += 1
+                self.blocks_changed += changed
+                self.last_blocks_changed = changed
+                self.last_update_ms = elapsed
+                self.max_update_ms = max(self.max_update_ms, elapsed)
+                break
+
+        return task.cont
+
+    def setup_nature(self, *keepouts):
+        """Args:
+            keepouts (NodePath): the BulletRigidBodyNodes, like the goal gate foundation and poles,
+                                 around which natures must not be placed and balls must be swept.
+        """
+        self.placer.clear()
+
+        for nodepath in keepouts:
+            self.placer.add_keepout(nodepath)
+
         for i, terrain in enumerate(self.bullet_terrains):
-            if terrain.tile.count_pixels(0, 100) >= 1000:
+            # 334 = ceil(1000 / 3): the original threshold of 1000 counted the 3 channels of a BGR image.
+            if terrain.tile.count_pixels(0, 100) >= 334:
                 xy = terrain.tile.center - Vec2(terrain.tile.size / 2)
                 z = terrain.root.get_z() + 2
                 pos = Point3(xy, z)
@@ -199,42 +599,47 @@ class Terrains(NodePath):
 
             self.add_nature(terrain.tile)
 
+        self.natures.build()
+
     def add_nature(self, tile):
         n = tile.quadrant
 
-        for i, (x, y, area) in enumerate(tile.get_nature_info()):
-            x += random.uniform(-10, 10)
-            y += random.uniform(-10, 10)
-
-            if pos := self.check_position(x, y):
-
-                match area:
-                    case Areas.LOWLAND:
-                        self.natures.add_to_terrain(Rock(n, pos))
-                    case Areas.PLAIN:
-                        self.natures.add_to_terrain(Shrubbery(n, pos))
-                    case Areas.MOUNTAIN:
-                        self.natures.add_to_terrain(Pine(n, pos))
-                    case Areas.SUBALPINE:
-                        self.natures.add_to_terrain(Fir(n, pos))
-                    case Areas.ALPINE:
-                        self.natures.add_to_terrain(Grass(n, pos))
-
-    def check_position(self, x, y, sweep=True):
-        pt_from = Point3(x, y, 30)
-        pt_to = Point3(x, y, -30)
-
-        if sweep:
-            ts_from = TransformState.make_pos(pt_from)
-            ts_to = TransformState.make_pos(pt_to)
-            sweep_mask = Mask.nature | Mask.foundation
-
-            if self.world.sweep_test_closest(
-                    self.test_shape, ts_from, ts_to, sweep_mask, 0.0).has_hit():
-                return None
-
-        if (result := self.world.ray_test_closest(
-                pt_from, pt_to, mask=Mask.terrain)).has_hit():
-            return result.get_hit_pos()
-
-        return None
\ No newline at end of file
+        for xs, ys, areas in tile.get_nature_info():
+            xs = xs + np.random.uniform(-10, 10, len(xs))
+            ys = ys + np.random.uniform(-10, 10, len(ys))
+            valid = self.sampler.contains(xs, ys) & self.placer.filter_keepouts(xs, ys)
+
+            for area in np.unique(areas[valid]):
+                nature_type = self.get_nature_type(area)
+                idx = np.nonzero(valid & (areas == area))[0]
+
+                # Obstacles cannot be close to each other, so most candidates are dropped before testing.
+                if nature_type.obstacle:
+                    idx = idx[self.placer.thin(xs[idx], ys[idx])]
+
+                for x, y in zip(xs[idx].tolist(), ys[idx].tolist()):
+                    if pos := self.check_position(x, y):
+                        nature = self.natures.pool.get(nature_type, n, pos)
+                        self.natures.add_to_terrain(nature)
+
+                        if nature.obstacle:
+                            self.placer.add(x, y, nature.radius, nature.collision_radius)
+
+    def get_nature_type(self, area):
+        match area:
+            case Areas.LOWLAND:
+                return Rock
+            case Areas.PLAIN:
+                return Shrubbery
+            case Areas.MOUNTAIN:
+                return Pine
+            case Areas.SUBALPINE:
+                return Fir
+            case Areas.ALPINE:
+                return Grass
+
+    def check_position(self, x, y):
+        if not self.placer.is_free(x, y):
+            return None
+
+        return self.sampler.get_pos(x, y)
\ No newline at end of file
@@ -0,0 +1,112 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = b'AVBPACK\x00'
+VERSION = 1
+ALIGNMENT = 64
+PACK_NAME = 'terrain.pack'
+
+
+def get_pack_path(dir):
+    """Return the path of the terrain pack of a directory of elevation data.
+        Args:
+            dir (pathlib.Path): the directory of elevation data.
+    """
+    return dir / PACK_NAME
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_pack(path, arrays, meta):
+    """Write arrays into one binary file which can be read with a single mmap.
+       The file consists of the magic number, the version, the length of
+       a json header describing the arrays and meta data, and the aligned arrays.
+        Args:
+            path (pathlib.Path): the file to be written;
+            arrays (dict): numpy.ndarray keyed by name;
+            meta (dict): json serializable meta data;
+    """
+    entries = {}
+    offset = 0
+
+    for name, arr in arrays.items():
+        offset = align(offset)
+        entries[name] = dict(dtype=arr.dtype.str, shape=arr.shape, offset=offset)
+        offset += arr.nbytes
+
+    header = json.dumps(dict(meta=meta, arrays=entries)).encode()
+    prefix = MAGIC + struct.pack('<II', VERSION, len(header)) + header
+    start = align(len(prefix))
+    temp = path.with_suffix('.tmp')
+
+    with open(temp, 'wb') as f:
+        f.write(prefix)
+
+        for name, arr in arrays.items():
+            f.seek(start + entries[name]['offset'])
+            f.write(np.ascontiguousarray(arr).tobytes())
+
+    os.replace(temp, path)
+
+
+class PackError(Exception):
+    """Raised when a terrain pack is truncated or corrupt."""
+
+
+def read_pack(path):
+    """Return the meta data and the arrays of a terrain pack. The arrays are
+       read-only views of one memory map. Returns None if the file does not
+       exist or was written in another version, and raises PackError if the
+       file is truncated or corrupt.
+        Args:
+            path (pathlib.Path): the terrain pack.
+    """
+    try:
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        # An empty file cannot be mapped.
+        raise PackError(f'{path}: {e}') from e
+
+    size = len(MAGIC) + 8
+    if len(buf) < size or buf[:len(MAGIC)].tobytes() != MAGIC:
+        raise PackError(f'{path}: not a terrain pack')
+
+    version, header_len = struct.unpack('<II', buf[len(MAGIC):size].tobytes())
+    if version != VERSION:
+        return None
+
+    if size + header_len > len(buf):
+        raise PackError(f'{path}: truncated header')
+
+    try:
+        header = json.loads(buf[size:size + header_len].tobytes())
+        meta, entries = header['meta'], header['arrays']
+        if not isinstance(meta, dict) or not isinstance(entries, dict):
+            raise TypeError('meta and arrays must be objects')
+
+        start = align(size + header_len)
+        arrays = {name: read_array(buf, start, entry) for name, entry in entries.items()}
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        raise PackError(f'{path}: corrupt header ({e!r})') from e
+
+    return meta, arrays
+
+
+def read_array(buf, start, entry):
+    dtype = np.dtype(entry['dtype'])
+    shape = tuple(int(n) for n in entry['shape'])
+    offset = start + int(entry['offset'])
+    nbytes = dtype.itemsize * int(np.prod(shape))
+
+    if min(shape, default=0) < 0 or offset < start or offset + nbytes > len(buf):
+        raise ValueError('array out of the file')
+
+    return buf[offset:offset + nbytes].view(dtype).reshape(shape)
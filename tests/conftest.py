@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from panda3d.bullet import BulletRigidBodyNode, BulletHeightfieldShape, ZUp
+from panda3d.core import NodePath, PNMImage, Texture
+
+from constants import Mask
+from height_sampler import HeightSampler
+
+
+@pytest.fixture(scope='session')
+def make_terrain():
+    """Return a function which attaches a heightfield made from a 16-bit heightmap
+       to a world in the same way as BulletTerrain, and returns its HeightSampler.
+    """
+    def make(world, img, height):
+        h, w = img.shape
+        tex = Texture('heightmap')
+        tex.setup_2d_texture(w, h, Texture.T_unsigned_short, Texture.F_luminance)
+        # The first row of a texture is the bottom of the image.
+        tex.set_ram_image(np.ascontiguousarray(img[::-1]))
+        pnm = PNMImage()
+        tex.store(pnm)
+
+        shape = BulletHeightfieldShape(pnm, height, ZUp)
+        shape.set_use_diamond_subdivision(True)
+        terrain = NodePath(BulletRigidBodyNode('terrain'))
+        terrain.node().add_shape(shape)
+        terrain.set_collide_mask(Mask.terrain)
+        world.attach(terrain.node())
+
+        sampler = HeightSampler(height)
+        sampler.set_heightmap(img)
+        return sampler
+
+    return make
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from panda3d.core import load_prc_file_data, NodePath, Point3, TransformState
+
+load_prc_file_data('', f"""
+    window-type none
+    audio-library-name null
+    model-path {Path(__file__).resolve().parents[1]}""")
+
+from direct.showbase.ShowBase import ShowBase
+from panda3d.bullet import BulletWorld
+
+from ball_controller import BallController
+from goal_gate import GoalGate
+from nature_placer import NaturePlacer
+from natures import Rock, Fir
+from walker import Walker
+
+
+class Scores:
+
+    def add(self, avoid=0, hit=0):
+        pass
+
+
+@pytest.fixture(scope='module')
+def controller(make_terrain):
+    app = ShowBase()
+    world = BulletWorld()
+    rng = np.random.default_rng(1)
+
+    ys, xs = np.mgrid[0:257, 0:257]
+    img = (np.sin(xs / 9) + np.cos(ys / 13) + 2) / 4 * 65535
+    sampler = make_terrain(world, img.astype(np.uint16), 8)
+
+    gate = GoalGate(world)
+    gate.reparent_to(app.render)
+    gate.setup_gate(sampler.get_pos(0, 30), 30)
+    placer = NaturePlacer()
+    placer.add_keepout(gate.foundation)
+    placer.add_keepout(gate.poles)
+    obstacles = [gate.poles.left.get_pos(app.render), gate.poles.right.get_pos(app.render)]
+
+    for i in range(40):
+        x, y = rng.uniform(-60, 60, 2)
+        if not placer.filter_keepouts(np.array([x]), np.array([y]))[0]:
+            continue
+
+        pos = sampler.get_pos(x, y)
+        nature = Rock(0, pos) if i % 2 else Fir(0, pos)
+        nature.reparent_to(app.render)
+        world.attach(nature.node())
+        placer.add(x, y, nature.radius, nature.collision_radius)
+        obstacles.append(pos)
+
+    walker = Walker(world, sampler)
+    walker.reparent_to(app.render)
+    walker.set_pos(sampler.get_pos(0, 0))
+    obstacles.append(walker.get_pos())
+    world.do_physics(1 / 60)
+
+    yield BallController(world, walker, Scores(), sampler, placer), np.array(obstacles), rng
+    app.destroy()
+
+
+@pytest.mark.parametrize('spread, length', [(7, 1.5), (1.5, 0.3)])
+def test_may_collide_keeps_every_hit(controller, spread, length):
+    """Sweep segments around the natures, the goal gate poles and the walker, and over the terrain."""
+    controller, obstacles, rng = controller
+    n = 20000
+    last_pos = obstacles[rng.integers(len(obstacles), size=n)] \
+        + rng.uniform((-spread, -spread, -1), (spread, spread, 7), (n, 3))
+    pos = last_pos + rng.normal(size=(n, 3)) * rng.uniform(0.02, length, (n, 1))
+
+    candidates = controller.may_collide(last_pos, pos)
+    hits = np.array([
+        bool(controller.will_collide(TransformState.make_pos(Point3(*a)), TransformState.make_pos(Point3(*b))))
+        for a, b in zip(last_pos, pos)
+    ])
+
+    assert hits.sum() > 1000
+    assert not np.any(hits & ~candidates)
+
+
+def test_sweep_states_are_reused(controller):
+    controller, obstacles, rng = controller
+    trajectories = controller.trajectories
+    # A ball skimming the walker is swept at every step.
+    start = controller.walker.get_pos() + Point3(-1, 0, 1)
+    trajectories.add(NodePath('ball'), (start, start + Point3(1, 0, 0), start + Point3(2, 0, 0)), speed=0.1)
+
+    controller.find_collisions(*trajectories.advance(0.1))
+    state = trajectories.states[0]
+    controller.find_collisions(*trajectories.advance(0.1))
+
+    assert trajectories.last_states[0] is state
+    assert trajectories.states[0] is not state
+    trajectories.remove(0)
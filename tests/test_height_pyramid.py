@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from panda3d.bullet import BulletWorld
+from panda3d.core import Point3
+
+from constants import Mask
+from height_pyramid import HeightPyramid
+
+
+@pytest.fixture(scope='module')
+def terrain(make_terrain):
+    world = BulletWorld()
+    rng = np.random.default_rng(24)
+    img = rng.integers(0, 65536, (33, 33), dtype=np.uint16)
+    pyramid = HeightPyramid(make_terrain(world, img, 10))
+    pyramid.build()
+    return world, pyramid
+
+
+def test_fractions_agree_with_bullet(terrain):
+    world, pyramid = terrain
+    rng = np.random.default_rng(0)
+    n = 3000
+    # Segments of any direction, some of which start or end outside the terrain.
+    starts = rng.uniform((-20, -20, -8), (20, 20, 8), (n, 3))
+    ends = starts + rng.normal(size=(n, 3)) * rng.uniform(0.5, 20, (n, 1))
+    fractions = pyramid.ray_test_batch(starts, ends)
+
+    for start, end, fraction in zip(starts.tolist(), ends.tolist(), fractions.tolist()):
+        result = world.ray_test_closest(Point3(*start), Point3(*end), Mask.terrain)
+        assert result.has_hit() == (not np.isnan(fraction))
+
+        if result.has_hit():
+            assert abs(result.get_hit_fraction() - fraction) < 1e-4
+
+
+def test_ray_test(terrain):
+    world, pyramid = terrain
+    pt_from, pt_to = Point3(1.5, -2.5, 10), Point3(1.5, -2.5, -10)
+    hit = pyramid.ray_test(pt_from, pt_to)
+    assert abs(hit.z - pyramid.sampler.get_height(1.5, -2.5)) < 1e-4
+    assert pyramid.ray_test(pt_from, Point3(1.5, -2.5, 6)) is None
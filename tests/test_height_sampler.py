@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from panda3d.bullet import BulletWorld
+from panda3d.core import Point3
+
+from constants import Mask
+
+
+@pytest.fixture(scope='module')
+def terrain(make_terrain):
+    world = BulletWorld()
+    rng = np.random.default_rng(7)
+    img = rng.integers(0, 65536, (33, 33), dtype=np.uint16)
+    return world, make_terrain(world, img, 10)
+
+
+def test_heights_agree_with_bullet(terrain):
+    world, sampler = terrain
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(-sampler.half, sampler.half, (2, 2000))
+    zs = sampler.get_height(xs, ys)
+
+    for x, y, z in zip(xs.tolist(), ys.tolist(), zs.tolist()):
+        result = world.ray_test_closest(Point3(x, y, 10), Point3(x, y, -10), Mask.terrain)
+        assert result.has_hit()
+        hit = result.get_hit_pos().z
+        assert abs(sampler.get_height(x, y) - hit) < 1e-4
+        assert abs(z - hit) < 1e-4
+
+
+def test_outside(terrain):
+    _, sampler = terrain
+    assert sampler.get_height(sampler.half + 1, 0) is None
+    assert np.isnan(sampler.get_height(np.array([0, sampler.half + 1]), np.array([0, 0]))[1])
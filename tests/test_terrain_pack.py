@@ -0,0 +1,58 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from heightmap import HeightMap
+from terrain_pack import MAGIC, VERSION, PackError, read_pack, write_pack
+
+
+@pytest.fixture
+def pack(tmp_path):
+    path = tmp_path / 'terrain.pack'
+    arrays = dict(heightmap=np.arange(24, dtype='u2').reshape(4, 6), hist=np.ones(16, dtype='i8'))
+    write_pack(path, arrays, dict(sources={}, ratio=[0.5, 0.5]))
+    return path
+
+
+def test_read_pack(pack):
+    meta, arrays = read_pack(pack)
+    assert meta['ratio'] == [0.5, 0.5]
+    assert arrays['heightmap'].tolist() == np.arange(24).reshape(4, 6).tolist()
+
+
+def test_missing_pack(tmp_path):
+    assert read_pack(tmp_path / 'terrain.pack') is None
+
+
+@pytest.mark.parametrize('length', [0, 4, len(MAGIC) + 8, len(MAGIC) + 20, -1])
+def test_truncated_pack(pack, length):
+    data = pack.read_bytes()
+    pack.write_bytes(data[:length % len(data)])
+
+    with pytest.raises(PackError):
+        read_pack(pack)
+
+
+@pytest.mark.parametrize('header', [b'{"meta": {', b'[]', b'{"meta": {}, "arrays": {"a": {"dtype": "<u2"}}}'])
+def test_corrupt_header(tmp_path, header):
+    path = tmp_path / 'terrain.pack'
+    path.write_bytes(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+
+    with pytest.raises(PackError):
+        read_pack(path)
+
+
+def test_array_out_of_file(tmp_path):
+    header = json.dumps(dict(meta={}, arrays=dict(a=dict(dtype='<u2', shape=[1024], offset=0)))).encode()
+    path = tmp_path / 'terrain.pack'
+    path.write_bytes(MAGIC + struct.pack('<II', VERSION, len(header)) + header + bytes(64))
+
+    with pytest.raises(PackError):
+        read_pack(path)
+
+
+def test_load_truncated_pack_falls_back(pack):
+    pack.write_bytes(pack.read_bytes()[:-8])
+    assert HeightMap().load_pack(pack.parent) is None
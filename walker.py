@@ -5,7 +5,7 @@ from panda3d.bullet import BulletCapsuleShape, ZUp
 from panda3d.bullet import BulletSphereShape
 from panda3d.bullet import BulletRigidBodyNode
 from panda3d.core import PandaNode, NodePath, TransformState
-from panda3d.core import Vec3
+from panda3d.core import Vec3, Point3
 
 from constants import Config, Mask
 
@@ -24,9 +24,10 @@ class Walker(NodePath):
     RUN = 'run'
     WALK = 'walk'
 
-    def __init__(self, world):
+    def __init__(self, world, sampler):
         super().__init__(BulletRigidBodyNode('wolker'))
         self.world = world
+        self.sampler = sampler
         self.test_shape = BulletSphereShape(0.5)
         self.moving_direction = 0
 
@@ -54,6 +55,9 @@ class Walker(NodePath):
         self.actor.set_name('ralph')
         self.actor.reparent_to(self.direction_nd)
 
+        # The states before and after the last step, which rendered transforms are interpolated between.
+        self.last_state = self.state = (Point3(), 180)
+
     def navigate(self):
         """Return a relative point to enable camera to follow a character
            when camera's view is blocked by an object like walls.
@@ -61,26 +65,50 @@ class Walker(NodePath):
         return self.get_relative_point(self.direction_nd, Vec3(0, 10, 2))
 
     def get_terrain_contact_pos(self, pos=None):
+        """Return the point on the terrain surface below the walker.
+           Natures are not taken into account; predict_collision keeps
+           the walker from moving into them.
+        """
         if not pos:
             pos = self.get_pos()
 
-        below = pos - Vec3(0, 0, 30)
-        if (hit := self.world.ray_test_closest(
-                pos, below, Mask.environment)).has_hit():
-            return hit.get_hit_pos()
-
-        return None
+        return self.sampler.get_pos(pos.x, pos.y)
 
     def get_orientation(self):
         return self.direction_nd.get_quat(base.render).get_forward()
 
+    def get_bounds(self):
+        """Return the lower and upper corners of the box containing the capsule."""
+        shape = self.node().get_shape(0)
+        scale = self.get_sx()
+        r = shape.get_radius() * scale
+        h = (shape.get_half_height() + shape.get_radius()) * scale
+        pos = self.get_pos()
+        return pos - Vec3(r, r, h), pos + Vec3(r, r, h)
+
     def predict_collision(self, next_pos):
         ts_from = TransformState.make_pos(self.get_pos())
         ts_to = TransformState.make_pos(next_pos)
         result = self.world.sweep_test_closest(self.test_shape, ts_from, ts_to, Mask.nature, 0.0)
         return result.has_hit()
 
+    def place(self, pos):
+        """Move the walker without interpolation, like at the start of a game."""
+        self.set_pos(pos)
+        self.last_state = self.state = (pos, self.direction_nd.get_h())
+
+    def restore(self):
+        pos, h = self.state
+        self.set_pos(pos)
+        self.direction_nd.set_h(h)
+
+    def interpolate(self, alpha):
+        (last_pos, last_h), (pos, h) = self.last_state, self.state
+        self.set_pos(last_pos + (pos - last_pos) * alpha)
+        self.direction_nd.set_h(last_h + ((h - last_h + 180) % 360 - 180) * alpha)
+
     def update(self, dt, motions):
+        self.last_state = self.state
         direction = 0
         angle = 0
         motion = None
@@ -102,6 +130,7 @@ class Walker(NodePath):
         self.move(direction, dt)
         self.play_anim(motion)
         self.moving_direction = direction
+        self.state = (self.get_pos(), self.direction_nd.get_h())
 
     def turn(self, angle):
         if angle: